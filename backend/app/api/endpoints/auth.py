@@ -1,17 +1,22 @@
 from datetime import timedelta
 from typing import Optional
+from urllib.parse import urlencode
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from fastapi.responses import RedirectResponse
 from pydantic import BaseModel, EmailStr
-from sqlalchemy.orm import Session
+from sqlalchemy import exists, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+import asyncio
 import httpx
 import secrets
 
+from app.core.cache import get_cached_session, cache_session, revoke_session, invalidate_user_sessions
 from app.core.config import settings
 from app.core.security import (
     create_access_token, 
     create_refresh_token, 
-    verify_password, 
+    verify_and_update_password,
     get_password_hash,
     verify_token,
     Token,
@@ -22,6 +27,13 @@ from app.db.models import User, UserProfile, Session as UserSession
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
+# Settings are fixed at startup, so the OAuth authorize URL is built once
+GITHUB_AUTH_URL = "https://github.com/login/oauth/authorize?" + urlencode({
+    "client_id": settings.GITHUB_CLIENT_ID,
+    "redirect_uri": settings.GITHUB_REDIRECT_URI,
+    "scope": "user:email,read:user"
+})
+
 
 # ============ Schemas ============
 
@@ -54,17 +66,24 @@ class RefreshRequest(BaseModel):
     refresh_token: str
 
 
+# ============ Helper Functions ============
+
+async def run_in_hash_pool(request: Request, fn, *args):
+    """Run CPU-bound password hashing in the process pool, off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(request.app.state.hash_pool, fn, *args)
+
+
 # ============ Endpoints ============
 
 @router.post("/signup", response_model=AuthResponse, status_code=status.HTTP_201_CREATED)
-async def signup(user_data: UserCreate, db: Session = Depends(get_db)):
+async def signup(user_data: UserCreate, request: Request, db: AsyncSession = Depends(get_db)):
     """
     Email/password signup.
     Creates a new user in Supabase auth.users and a corresponding profile.
     """
     # Check if user exists
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
-    if existing_user:
+    if await db.scalar(select(exists().where(User.email == user_data.email))):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
@@ -72,14 +91,14 @@ async def signup(user_data: UserCreate, db: Session = Depends(get_db)):
     
     # Create user (in production, use Supabase Admin API)
     # For now, we create directly in the database
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await run_in_hash_pool(request, get_password_hash, user_data.password)
     
     new_user = User(
         email=user_data.email,
         encrypted_password=hashed_password
     )
     db.add(new_user)
-    db.flush()
+    await db.flush()
     
     # Create profile
     profile = UserProfile(
@@ -87,8 +106,7 @@ async def signup(user_data: UserCreate, db: Session = Depends(get_db)):
         display_name=user_data.display_name
     )
     db.add(profile)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
     
     # Generate tokens
     access_token = create_access_token(str(new_user.id))
@@ -106,18 +124,36 @@ async def signup(user_data: UserCreate, db: Session = Depends(get_db)):
 
 
 @router.post("/login", response_model=AuthResponse)
-async def login(credentials: UserLogin, db: Session = Depends(get_db)):
+async def login(credentials: UserLogin, request: Request, db: AsyncSession = Depends(get_db)):
     """
     Email/password login.
     """
-    user = db.query(User).filter(User.email == credentials.email).first()
-    if not user or not verify_password(credentials.password, user.encrypted_password):
+    user = (await db.execute(
+        select(User)
+        .options(joinedload(User.profile))
+        .where(User.email == credentials.email)
+    )).scalar_one_or_none()
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
         )
     
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user.id).first()
+    password_valid, new_hash = await run_in_hash_pool(
+        request, verify_and_update_password, credentials.password, user.encrypted_password
+    )
+    if not password_valid:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid email or password"
+        )
+    
+    # Transparently re-hash legacy bcrypt / outdated Argon2 hashes
+    if new_hash:
+        user.encrypted_password = new_hash
+        await db.commit()
+    
+    profile = user.profile
     
     access_token = create_access_token(str(user.id))
     refresh_token = create_refresh_token(str(user.id))
@@ -141,34 +177,29 @@ async def github_auth():
     Initiate GitHub OAuth flow.
     Redirects to GitHub's authorization page.
     """
-    github_auth_url = (
-        f"https://github.com/login/oauth/authorize"
-        f"?client_id={settings.GITHUB_CLIENT_ID}"
-        f"&redirect_uri={settings.GITHUB_REDIRECT_URI}"
-        f"&scope=user:email,read:user"
-    )
-    return RedirectResponse(url=github_auth_url)
+    return RedirectResponse(url=GITHUB_AUTH_URL)
 
 
 @router.get("/github/callback")
-async def github_callback(code: str, db: Session = Depends(get_db)):
+async def github_callback(code: str, request: Request, db: AsyncSession = Depends(get_db)):
     """
     GitHub OAuth callback.
     Exchanges code for access token and creates/updates user.
     """
+    client: httpx.AsyncClient = request.app.state.http
+    
     # Exchange code for access token
-    async with httpx.AsyncClient() as client:
-        token_response = await client.post(
-            "https://github.com/login/oauth/access_token",
-            data={
-                "client_id": settings.GITHUB_CLIENT_ID,
-                "client_secret": settings.GITHUB_CLIENT_SECRET,
-                "code": code,
-                "redirect_uri": settings.GITHUB_REDIRECT_URI
-            },
-            headers={"Accept": "application/json"}
-        )
-        token_data = token_response.json()
+    token_response = await client.post(
+        "https://github.com/login/oauth/access_token",
+        data={
+            "client_id": settings.GITHUB_CLIENT_ID,
+            "client_secret": settings.GITHUB_CLIENT_SECRET,
+            "code": code,
+            "redirect_uri": settings.GITHUB_REDIRECT_URI
+        },
+        headers={"Accept": "application/json"}
+    )
+    token_data = token_response.json()
     
     if "error" in token_data:
         raise HTTPException(
@@ -177,31 +208,24 @@ async def github_callback(code: str, db: Session = Depends(get_db)):
         )
     
     github_access_token = token_data["access_token"]
+    github_headers = {
+        "Authorization": f"Bearer {github_access_token}",
+        "Accept": "application/json"
+    }
     
-    # Get user info from GitHub
-    async with httpx.AsyncClient() as client:
-        user_response = await client.get(
-            "https://api.github.com/user",
-            headers={
-                "Authorization": f"Bearer {github_access_token}",
-                "Accept": "application/json"
-            }
-        )
-        github_user = user_response.json()
-        
-        # Get primary email
-        emails_response = await client.get(
-            "https://api.github.com/user/emails",
-            headers={
-                "Authorization": f"Bearer {github_access_token}",
-                "Accept": "application/json"
-            }
-        )
-        emails = emails_response.json()
-        primary_email = next(
-            (e["email"] for e in emails if e.get("primary")),
-            github_user.get("email")
-        )
+    # Get user info and emails from GitHub (independent, so fetched concurrently)
+    user_response, emails_response = await asyncio.gather(
+        client.get("https://api.github.com/user", headers=github_headers),
+        client.get("https://api.github.com/user/emails", headers=github_headers)
+    )
+    github_user = user_response.json()
+    emails = emails_response.json()
+    
+    # Get primary email
+    primary_email = next(
+        (e["email"] for e in emails if e.get("primary")),
+        github_user.get("email")
+    )
     
     if not primary_email:
         raise HTTPException(
@@ -209,54 +233,56 @@ async def github_callback(code: str, db: Session = Depends(get_db)):
             detail="No email found in GitHub account"
         )
     
-    # Check if user exists by GitHub ID or email
-    profile = db.query(UserProfile).filter(UserProfile.github_id == str(github_user["id"])).first()
-    
-    if profile:
-        # Update existing user's GitHub info
-        profile.github_username = github_user["login"]
-        profile.github_avatar_url = github_user["avatar_url"]
-        profile.github_access_token = github_access_token
-        user = db.query(User).filter(User.id == profile.user_id).first()
-    else:
-        # Check if email exists
-        user = db.query(User).filter(User.email == primary_email).first()
-        if user:
-            # Link GitHub to existing user
-            profile = db.query(UserProfile).filter(UserProfile.user_id == user.id).first()
+    github_id = str(github_user["id"])
+    
+    async with db.begin():
+        # Find the user by GitHub ID or email in one round-trip
+        rows = (await db.execute(
+            select(User, UserProfile)
+            .outerjoin(UserProfile, UserProfile.user_id == User.id)
+            .where(or_(UserProfile.github_id == github_id, User.email == primary_email))
+        )).all()
+        # Prefer the account already linked to this GitHub ID over an email match
+        match = (
+            next((row for row in rows if row.UserProfile and row.UserProfile.github_id == github_id), None)
+            or next((row for row in rows if row.User.email == primary_email), None)
+        )
+        
+        if match:
+            user, profile = match
             if profile:
-                profile.github_id = str(github_user["id"])
+                # Update GitHub info on an existing (or email-matched) profile
+                profile.github_id = github_id
                 profile.github_username = github_user["login"]
                 profile.github_avatar_url = github_user["avatar_url"]
                 profile.github_access_token = github_access_token
             else:
-                profile = UserProfile(
+                # Link GitHub to existing user
+                db.add(UserProfile(
                     user_id=user.id,
-                    github_id=str(github_user["id"]),
+                    github_id=github_id,
                     github_username=github_user["login"],
                     github_avatar_url=github_user["avatar_url"],
                     github_access_token=github_access_token,
                     display_name=github_user.get("name", github_user["login"])
-                )
-                db.add(profile)
+                ))
         else:
             # Create new user
             user = User(email=primary_email)
             db.add(user)
-            db.flush()
+            await db.flush()
             
-            profile = UserProfile(
+            db.add(UserProfile(
                 user_id=user.id,
-                github_id=str(github_user["id"]),
+                github_id=github_id,
                 github_username=github_user["login"],
                 github_avatar_url=github_user["avatar_url"],
                 github_access_token=github_access_token,
                 display_name=github_user.get("name", github_user["login"])
-            )
-            db.add(profile)
+            ))
     
-    db.commit()
-    db.refresh(user)
+    # Cached /me responses for the user's other tokens predate this profile write
+    await invalidate_user_sessions(str(user.id))
     
     # Generate tokens
     access_token = create_access_token(str(user.id))
@@ -268,7 +294,7 @@ async def github_callback(code: str, db: Session = Depends(get_db)):
 
 
 @router.post("/logout")
-async def logout(request: Request, db: Session = Depends(get_db)):
+async def logout(request: Request, db: AsyncSession = Depends(get_db)):
     """
     Logout user by invalidating their session.
     """
@@ -289,17 +315,22 @@ async def logout(request: Request, db: Session = Depends(get_db)):
         )
     
     # Mark all user sessions as inactive
-    db.query(UserSession).filter(
-        UserSession.user_id == payload.sub,
-        UserSession.is_active == True
-    ).update({"is_active": False})
-    db.commit()
+    await db.execute(
+        update(UserSession)
+        .where(
+            UserSession.user_id == payload.sub,
+            UserSession.is_active == True
+        )
+        .values(is_active=False)
+    )
+    await db.commit()
+    await revoke_session(token, payload.exp)
     
     return {"message": "Successfully logged out"}
 
 
 @router.get("/me", response_model=UserResponse)
-async def get_current_user(request: Request, db: Session = Depends(get_db)):
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_db)):
     """
     Get current authenticated user.
     """
@@ -311,6 +342,15 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)):
         )
     
     token = auth_header.split(" ")[1]
+    cached_user, revoked = await get_cached_session(token)
+    if revoked:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token"
+        )
+    if cached_user:
+        return UserResponse(**cached_user)
+    
     payload = verify_token(token)
     
     if not payload:
@@ -319,26 +359,33 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)):
             detail="Invalid or expired token"
         )
     
-    user = db.query(User).filter(User.id == payload.sub).first()
+    user = (await db.execute(
+        select(User)
+        .options(joinedload(User.profile))
+        .where(User.id == payload.sub)
+    )).scalar_one_or_none()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user.id).first()
+    profile = user.profile
     
-    return UserResponse(
+    user_response = UserResponse(
         id=str(user.id),
         email=user.email,
         display_name=profile.display_name if profile else None,
         github_username=profile.github_username if profile else None,
         github_avatar_url=profile.github_avatar_url if profile else None
     )
+    await cache_session(token, user_response.model_dump(), payload.exp)
+    
+    return user_response
 
 
 @router.post("/refresh", response_model=Token)
-async def refresh_token(refresh_data: RefreshRequest, db: Session = Depends(get_db)):
+async def refresh_token(refresh_data: RefreshRequest, db: AsyncSession = Depends(get_db)):
     """
     Refresh JWT token.
     """
@@ -350,7 +397,9 @@ async def refresh_token(refresh_data: RefreshRequest, db: Session = Depends(get_
             detail="Invalid or expired refresh token"
         )
     
-    user = db.query(User).filter(User.id == payload.sub).first()
+    user = (await db.execute(
+        select(User).where(User.id == payload.sub)
+    )).scalar_one_or_none()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
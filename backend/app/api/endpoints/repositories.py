@@ -1,18 +1,23 @@
 """
 Repository API Endpoints
 """
+from dataclasses import dataclass
 from typing import Optional, List
 from uuid import UUID
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request, Response
 from pydantic import BaseModel, HttpUrl
-from sqlalchemy.orm import Session
+from sqlalchemy import exists, func, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+import ciso8601
+import orjson
 
+from app.core.cache import get_cached_session, get_cached_repositories, cache_repositories, invalidate_repositories
 from app.core.security import verify_token
 from app.db.session import get_db
 from app.db.models import UserProfile
 from app.db.models_repo import Repository, RepositoryMember, RepositorySettings, Webhook
-from app.services.github import GitHubService, generate_webhook_secret, parse_github_datetime
+from app.services.github import GitHubRateLimited, GitHubService, generate_webhook_secret, parse_github_datetime
 
 router = APIRouter(prefix="/api/repositories", tags=["repositories"])
 
@@ -23,7 +28,7 @@ class RepositoryCreate(BaseModel):
     full_name: str  # owner/repo format
 
 class RepositoryResponse(BaseModel):
-    id: str
+    id: UUID
     github_id: int
     name: str
     full_name: str
@@ -41,6 +46,10 @@ class RepositoryResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class RepositoryPage(BaseModel):
+    items: List[RepositoryResponse]
+    next_cursor: Optional[str] = None
+
 class RepositorySettingsUpdate(BaseModel):
     auto_sync: Optional[bool] = None
     sync_interval_minutes: Optional[int] = None
@@ -53,19 +62,29 @@ class RepositorySettingsUpdate(BaseModel):
 
 class BranchResponse(BaseModel):
     name: str
-    protected: bool
+    protected: bool = False
 
 class WebhookResponse(BaseModel):
-    id: str
+    id: UUID
     github_hook_id: Optional[int]
     events: List[str]
     is_active: bool
     last_delivery_at: Optional[datetime]
     last_delivery_status: Optional[str]
+    
+    class Config:
+        from_attributes = True
 
 
 # ============ Helper Functions ============
 
+@dataclass
+class CurrentUser:
+    """Authenticated user and their profile, resolved once per request."""
+    user_id: str
+    profile: Optional[UserProfile]
+
+
 async def get_current_user_id(request: Request) -> str:
     """Extract user ID from JWT token."""
     auth_header = request.headers.get("Authorization")
@@ -73,6 +92,17 @@ async def get_current_user_id(request: Request) -> str:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
     
     token = auth_header.split(" ")[1]
+    cached_user, revoked = await get_cached_session(token)
+    if revoked:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    if cached_user:
+        return cached_user["id"]
+    
+    # JWTAuthMiddleware has already verified this token for the request
+    verified_user_id = getattr(request.state, "user_id", None)
+    if verified_user_id:
+        return verified_user_id
+    
     payload = verify_token(token)
     if not payload:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
@@ -80,9 +110,20 @@ async def get_current_user_id(request: Request) -> str:
     return payload.sub
 
 
-async def get_github_service(user_id: str, db: Session) -> GitHubService:
+async def get_current_user(
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
+) -> CurrentUser:
+    """Resolve the current user's profile alongside their ID."""
+    profile = (await db.execute(
+        select(UserProfile).where(UserProfile.user_id == user_id)
+    )).scalar_one_or_none()
+    return CurrentUser(user_id=user_id, profile=profile)
+
+
+def get_github_service(current_user: CurrentUser) -> GitHubService:
     """Get GitHub service with user's access token."""
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user_id).first()
+    profile = current_user.profile
     if not profile or not profile.github_access_token:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -91,49 +132,85 @@ async def get_github_service(user_id: str, db: Session) -> GitHubService:
     return GitHubService(profile.github_access_token)
 
 
+async def get_owned_repository(db: AsyncSession, repo_id: UUID, user_id: str) -> Repository:
+    """
+    Load a repository by primary key and check it belongs to the user.
+    db.get can answer from the session's identity map without a query.
+    """
+    repo = await db.get(Repository, repo_id)
+    if not repo or str(repo.owner_id) != str(user_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Repository not found")
+    return repo
+
+
+def encode_repository_cursor(repo: Repository) -> str:
+    """Encode a repository's (updated_at, id) sort key as a page cursor."""
+    return f"{repo.updated_at.isoformat()}|{repo.id}"
+
+
+def decode_repository_cursor(cursor: str):
+    """Decode a page cursor back into an (updated_at, id) sort key."""
+    try:
+        updated_at, repo_id = cursor.split("|", 1)
+        return ciso8601.parse_datetime(updated_at), UUID(repo_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
 # ============ Endpoints ============
 
-@router.get("", response_model=List[RepositoryResponse])
+@router.get("", response_model=RepositoryPage)
 async def list_repositories(
-    request: Request,
-    db: Session = Depends(get_db),
-    include_inactive: bool = False
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
+    include_inactive: bool = False,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=100)
 ):
-    """List all repositories for the current user."""
-    user_id = await get_current_user_id(request)
-    
-    query = db.query(Repository).filter(Repository.owner_id == user_id)
+    """
+    List repositories for the current user, most recently updated first.
+    Pages are keyset-paginated; pass the returned next_cursor to get the next page.
+    """
+    cache_variant = f"list:{int(include_inactive)}:{limit}:{cursor or ''}"
+    cached = await get_cached_repositories(user_id, cache_variant)
+    if cached:
+        return Response(content=cached, media_type="application/json")
+    
+    query = select(Repository).where(Repository.owner_id == user_id)
     if not include_inactive:
-        query = query.filter(Repository.is_active == True)
-    
-    repos = query.order_by(Repository.updated_at.desc()).all()
-    return [RepositoryResponse(
-        id=str(r.id),
-        github_id=r.github_id,
-        name=r.name,
-        full_name=r.full_name,
-        description=r.description,
-        html_url=r.html_url,
-        visibility=r.visibility,
-        default_branch=r.default_branch,
-        language=r.language,
-        stars_count=r.stars_count,
-        forks_count=r.forks_count,
-        open_issues_count=r.open_issues_count,
-        is_active=r.is_active,
-        last_synced_at=r.last_synced_at
-    ) for r in repos]
+        query = query.where(Repository.is_active == True)
+    if cursor:
+        query = query.where(
+            tuple_(Repository.updated_at, Repository.id) < decode_repository_cursor(cursor)
+        )
+    
+    # Fetch one extra row to know whether another page follows
+    repos = (await db.execute(
+        query.order_by(Repository.updated_at.desc(), Repository.id.desc()).limit(limit + 1)
+    )).scalars().all()
+    next_cursor = encode_repository_cursor(repos[limit - 1]) if len(repos) > limit else None
+    response = RepositoryPage(
+        items=[RepositoryResponse.model_validate(r) for r in repos[:limit]],
+        next_cursor=next_cursor
+    )
+    
+    payload = orjson.dumps(response.model_dump())
+    await cache_repositories(user_id, cache_variant, payload)
+    return Response(content=payload, media_type="application/json")
 
 
 @router.post("", response_model=RepositoryResponse, status_code=status.HTTP_201_CREATED)
 async def add_repository(
     repo_data: RepositoryCreate,
-    request: Request,
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Add a new repository to track."""
-    user_id = await get_current_user_id(request)
-    github = await get_github_service(user_id, db)
+    user_id = current_user.user_id
+    github = get_github_service(current_user)
     
     # Parse owner/repo
     parts = repo_data.full_name.split("/")
@@ -145,11 +222,11 @@ async def add_repository(
     owner, repo_name = parts
     
     # Check if already exists
-    existing = db.query(Repository).filter(
+    already_added = await db.scalar(select(exists().where(
         Repository.full_name == repo_data.full_name,
         Repository.owner_id == user_id
-    ).first()
-    if existing:
+    )))
+    if already_added:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Repository already added"
@@ -158,6 +235,8 @@ async def add_repository(
     # Fetch from GitHub
     try:
         github_repo = await github.get_repository(owner, repo_name)
+    except GitHubRateLimited:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -183,93 +262,55 @@ async def add_repository(
         open_issues_count=github_repo.get("open_issues_count", 0),
         watchers_count=github_repo.get("watchers_count", 0),
         github_created_at=parse_github_datetime(github_repo.get("created_at")),
-        github_updated_at=parse_github_datetime(github_repo.get("updated_at")),
-        last_synced_at=datetime.utcnow()
+        github_updated_at=parse_github_datetime(github_repo.get("updated_at"))
     )
     db.add(new_repo)
-    db.flush()
+    await db.flush()
     
     # Create default settings
     settings = RepositorySettings(repository_id=new_repo.id)
     db.add(settings)
     
-    db.commit()
-    db.refresh(new_repo)
-    
-    return RepositoryResponse(
-        id=str(new_repo.id),
-        github_id=new_repo.github_id,
-        name=new_repo.name,
-        full_name=new_repo.full_name,
-        description=new_repo.description,
-        html_url=new_repo.html_url,
-        visibility=new_repo.visibility,
-        default_branch=new_repo.default_branch,
-        language=new_repo.language,
-        stars_count=new_repo.stars_count,
-        forks_count=new_repo.forks_count,
-        open_issues_count=new_repo.open_issues_count,
-        is_active=new_repo.is_active,
-        last_synced_at=new_repo.last_synced_at
-    )
+    await db.commit()
+    await invalidate_repositories(user_id)
+    
+    return RepositoryResponse.model_validate(new_repo)
 
 
 @router.get("/{repo_id}", response_model=RepositoryResponse)
 async def get_repository(
     repo_id: UUID,
-    request: Request,
-    db: Session = Depends(get_db)
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get repository details."""
-    user_id = await get_current_user_id(request)
+    cache_variant = f"repo:{repo_id}"
+    cached = await get_cached_repositories(user_id, cache_variant)
+    if cached:
+        return Response(content=cached, media_type="application/json")
     
-    repo = db.query(Repository).filter(
-        Repository.id == repo_id,
-        Repository.owner_id == user_id
-    ).first()
+    repo = await get_owned_repository(db, repo_id, user_id)
     
-    if not repo:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Repository not found")
+    response = RepositoryResponse.model_validate(repo)
     
-    return RepositoryResponse(
-        id=str(repo.id),
-        github_id=repo.github_id,
-        name=repo.name,
-        full_name=repo.full_name,
-        description=repo.description,
-        html_url=repo.html_url,
-        visibility=repo.visibility,
-        default_branch=repo.default_branch,
-        language=repo.language,
-        stars_count=repo.stars_count,
-        forks_count=repo.forks_count,
-        open_issues_count=repo.open_issues_count,
-        is_active=repo.is_active,
-        last_synced_at=repo.last_synced_at
-    )
+    payload = orjson.dumps(response.model_dump())
+    await cache_repositories(user_id, cache_variant, payload)
+    return Response(content=payload, media_type="application/json")
 
 
 @router.put("/{repo_id}")
 async def update_repository_settings(
     repo_id: UUID,
     settings_update: RepositorySettingsUpdate,
-    request: Request,
-    db: Session = Depends(get_db)
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
 ):
     """Update repository settings."""
-    user_id = await get_current_user_id(request)
+    await get_owned_repository(db, repo_id, user_id)
     
-    repo = db.query(Repository).filter(
-        Repository.id == repo_id,
-        Repository.owner_id == user_id
-    ).first()
-    
-    if not repo:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Repository not found")
-    
-    settings = db.query(RepositorySettings).filter(
-        RepositorySettings.repository_id == repo_id
-    ).first()
+    settings = (await db.execute(
+        select(RepositorySettings).where(RepositorySettings.repository_id == repo_id)
+    )).scalar_one_or_none()
     
     if not settings:
         settings = RepositorySettings(repository_id=repo_id)
@@ -280,7 +321,8 @@ async def update_repository_settings(
     for key, value in update_data.items():
         setattr(settings, key, value)
     
-    db.commit()
+    await db.commit()
+    await invalidate_repositories(user_id)
     
     return {"message": "Settings updated successfully"}
 
@@ -288,22 +330,15 @@ async def update_repository_settings(
 @router.delete("/{repo_id}")
 async def delete_repository(
     repo_id: UUID,
-    request: Request,
-    db: Session = Depends(get_db)
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
 ):
     """Remove repository from tracking."""
-    user_id = await get_current_user_id(request)
+    repo = await get_owned_repository(db, repo_id, user_id)
     
-    repo = db.query(Repository).filter(
-        Repository.id == repo_id,
-        Repository.owner_id == user_id
-    ).first()
-    
-    if not repo:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Repository not found")
-    
-    db.delete(repo)
-    db.commit()
+    await db.delete(repo)
+    await db.commit()
+    await invalidate_repositories(user_id)
     
     return {"message": "Repository removed successfully"}
 
@@ -311,46 +346,51 @@ async def delete_repository(
 @router.post("/{repo_id}/sync")
 async def sync_repository(
     repo_id: UUID,
-    request: Request,
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Manually sync repository data from GitHub."""
-    user_id = await get_current_user_id(request)
-    
-    repo = db.query(Repository).filter(
-        Repository.id == repo_id,
-        Repository.owner_id == user_id
-    ).first()
+    user_id = current_user.user_id
     
-    if not repo:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Repository not found")
+    repo = await get_owned_repository(db, repo_id, user_id)
     
-    github = await get_github_service(user_id, db)
+    github = get_github_service(current_user)
     parts = repo.full_name.split("/")
     
     try:
         github_repo = await github.get_repository(parts[0], parts[1])
         
-        # Update repository data
-        repo.description = github_repo.get("description")
-        repo.visibility = github_repo.get("visibility", "public")
-        repo.default_branch = github_repo.get("default_branch", "main")
-        repo.language = github_repo.get("language")
-        repo.stars_count = github_repo.get("stargazers_count", 0)
-        repo.forks_count = github_repo.get("forks_count", 0)
-        repo.open_issues_count = github_repo.get("open_issues_count", 0)
-        repo.watchers_count = github_repo.get("watchers_count", 0)
-        repo.github_updated_at = parse_github_datetime(github_repo.get("updated_at"))
-        repo.last_synced_at = datetime.utcnow()
-        repo.sync_error = None
+        # Update repository data; RETURNING hands back the database-stamped
+        # sync time so reading it doesn't need a second SELECT
+        last_synced_at = (await db.execute(
+            update(Repository)
+            .where(Repository.id == repo.id)
+            .values(
+                description=github_repo.get("description"),
+                visibility=github_repo.get("visibility", "public"),
+                default_branch=github_repo.get("default_branch", "main"),
+                language=github_repo.get("language"),
+                stars_count=github_repo.get("stargazers_count", 0),
+                forks_count=github_repo.get("forks_count", 0),
+                open_issues_count=github_repo.get("open_issues_count", 0),
+                watchers_count=github_repo.get("watchers_count", 0),
+                github_updated_at=parse_github_datetime(github_repo.get("updated_at")),
+                last_synced_at=func.now(),
+                sync_error=None
+            )
+            .returning(Repository.last_synced_at)
+        )).scalar_one()
         
-        db.commit()
+        await db.commit()
+        await invalidate_repositories(user_id)
         
-        return {"message": "Repository synced successfully", "last_synced_at": repo.last_synced_at}
+        return {"message": "Repository synced successfully", "last_synced_at": last_synced_at}
         
+    except GitHubRateLimited:
+        raise
     except Exception as e:
         repo.sync_error = str(e)
-        db.commit()
+        await db.commit()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Sync failed: {str(e)}"
@@ -360,26 +400,22 @@ async def sync_repository(
 @router.get("/{repo_id}/branches", response_model=List[BranchResponse])
 async def list_branches(
     repo_id: UUID,
-    request: Request,
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """List branches for a repository."""
-    user_id = await get_current_user_id(request)
-    
-    repo = db.query(Repository).filter(
-        Repository.id == repo_id,
-        Repository.owner_id == user_id
-    ).first()
+    user_id = current_user.user_id
     
-    if not repo:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Repository not found")
+    repo = await get_owned_repository(db, repo_id, user_id)
     
-    github = await get_github_service(user_id, db)
+    github = get_github_service(current_user)
     parts = repo.full_name.split("/")
     
     try:
         branches = await github.list_branches(parts[0], parts[1])
-        return [BranchResponse(name=b["name"], protected=b.get("protected", False)) for b in branches]
+        return [BranchResponse.model_validate(b) for b in branches]
+    except GitHubRateLimited:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -390,27 +426,14 @@ async def list_branches(
 @router.get("/{repo_id}/webhooks", response_model=List[WebhookResponse])
 async def list_webhooks(
     repo_id: UUID,
-    request: Request,
-    db: Session = Depends(get_db)
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
 ):
     """List webhooks for a repository."""
-    user_id = await get_current_user_id(request)
-    
-    repo = db.query(Repository).filter(
-        Repository.id == repo_id,
-        Repository.owner_id == user_id
-    ).first()
-    
-    if not repo:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Repository not found")
+    await get_owned_repository(db, repo_id, user_id)
     
-    webhooks = db.query(Webhook).filter(Webhook.repository_id == repo_id).all()
+    webhooks = (await db.execute(
+        select(Webhook).where(Webhook.repository_id == repo_id)
+    )).scalars().all()
     
-    return [WebhookResponse(
-        id=str(w.id),
-        github_hook_id=w.github_hook_id,
-        events=w.events,
-        is_active=w.is_active,
-        last_delivery_at=w.last_delivery_at,
-        last_delivery_status=w.last_delivery_status
-    ) for w in webhooks]
+    return [WebhookResponse.model_validate(w) for w in webhooks]
@@ -1,94 +1,398 @@
 """
 Webhook Handler Endpoints
-Handles incoming GitHub webhook events.
+Handles incoming GitHub webhook events. Deliveries are verified in the
+request and handed to background workers, so GitHub gets its response
+without waiting on event handling.
 """
-from typing import Dict, Any
-from fastapi import APIRouter, Request, HTTPException, status, Header
+from typing import Dict, Any, List, NamedTuple, Optional, Set, Tuple
+from uuid import UUID
+from collections import defaultdict
+from cachetools import TTLCache
+from fastapi import APIRouter, Request, Response, HTTPException, status, Header
+from pydantic import BaseModel, Field
+from sqlalchemy import and_, bindparam, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import hmac
 import logging
-import json
+import orjson
+import time
 
-from app.services.github import verify_webhook_signature
-from app.db.session import SessionLocal
+from app.core.cache import claim_webhook_delivery
+from app.core.config import settings
+from app.services.github import keyed_webhook_hmac, parse_signature_header, match_webhook_signature
+from app.db.session import AsyncSessionLocal
 from app.db.models_repo import Repository, Webhook
 
 router = APIRouter(prefix="/api/webhooks", tags=["webhooks"])
 logger = logging.getLogger(__name__)
 
+# Most deliveries accepted in one batch request
+MAX_BATCH_DELIVERIES = 50
+
+
+class WebhookDelivery(BaseModel):
+    event: str
+    delivery: Optional[str] = None  # X-GitHub-Delivery
+    signature: Optional[str] = None
+    # The raw JSON body as GitHub sent it, so the signature can be checked over the exact bytes
+    payload: str
+
+
+class WebhookBatch(BaseModel):
+    deliveries: List[WebhookDelivery] = Field(..., max_length=MAX_BATCH_DELIVERIES)
+
 
 @router.post("/github")
 async def handle_github_webhook(
     request: Request,
+    response: Response,
     x_github_event: str = Header(...),
     x_hub_signature_256: str = Header(None),
-    x_github_delivery: str = Header(None)
+    x_github_delivery: str = Header(None),
+    x_github_hook_id: str = Header(None)
 ):
     """
     Handle incoming GitHub webhook events.
     """
-    body = await request.body()
+    # Malformed or missing signatures decode to None and are rejected before
+    # the body is read or hashed, and without touching the database
+    expected_signature = parse_signature_header(x_hub_signature_256)
+    if expected_signature is None:
+        raise _invalid_signature()
+    
+    # When the sending hook's secret is already cached, HMAC the body as it streams in
+    hook = _hook_cache.get(x_github_hook_id) if x_github_hook_id else None
+    if hook:
+        body, streamed_digest = await _read_body_with_hmac(request, hook[2])
+    else:
+        body, streamed_digest = await request.body(), None
     
     try:
-        payload = json.loads(body)
-    except json.JSONDecodeError:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid JSON payload"
         )
     
+    if not isinstance(payload, dict):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Payload is not a JSON object"
+        )
+    
     # Get repository info from payload
-    repo_data = payload.get("repository", {})
-    repo_full_name = repo_data.get("full_name")
+    repo_data = payload.get("repository")
+    repo_full_name = repo_data.get("full_name") if isinstance(repo_data, dict) else None
     
     if not repo_full_name:
         logger.warning(f"Webhook without repository info: {x_github_event}")
         return {"status": "ignored", "reason": "No repository in payload"}
     
-    # Find the repository and webhook in our database
-    db = SessionLocal()
-    try:
-        repo = db.query(Repository).filter(
-            Repository.full_name == repo_full_name
-        ).first()
-        
-        if not repo:
+    if (
+        streamed_digest is not None
+        and hook[1] == repo_full_name
+        and hmac.compare_digest(streamed_digest, expected_signature)
+    ):
+        repo_id = hook[0]
+    else:
+        repo_id = await _verify_repository_signature(body, expected_signature, repo_full_name)
+        if repo_id is None:
             logger.info(f"Webhook for untracked repo: {repo_full_name}")
             return {"status": "ignored", "reason": "Repository not tracked"}
-        
-        # Verify webhook signature
-        webhooks = db.query(Webhook).filter(
-            Webhook.repository_id == repo.id,
-            Webhook.is_active == True
-        ).all()
-        
-        signature_valid = False
-        for webhook in webhooks:
-            if verify_webhook_signature(body, x_hub_signature_256, webhook.secret):
-                signature_valid = True
-                break
-        
-        if not signature_valid and webhooks:
-            logger.warning(f"Invalid webhook signature for {repo_full_name}")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid webhook signature"
-            )
-        
-        # Handle the event
-        event_handler = WEBHOOK_HANDLERS.get(x_github_event)
-        if event_handler:
-            result = await event_handler(payload, repo, db)
-            return {"status": "processed", "event": x_github_event, "result": result}
-        else:
-            logger.info(f"Unhandled event type: {x_github_event}")
-            return {"status": "ignored", "reason": f"Unhandled event: {x_github_event}"}
-            
-    finally:
-        db.close()
+    
+    # Hand the event to a background worker
+    if x_github_event not in SUPPORTED_EVENTS:
+        logger.debug("Unhandled event type: %s", x_github_event)
+        return {"status": "ignored", "reason": f"Unhandled event: {x_github_event}"}
+    
+    # Claimed only once the signature checks out, so a forged request can't
+    # burn the id of a genuine delivery
+    if x_github_delivery and not await claim_webhook_delivery(x_github_delivery):
+        logger.info(f"Duplicate webhook delivery {x_github_delivery} for {repo_full_name}")
+        return {"status": "duplicate"}
+    
+    # Waits only when the queue is full, pushing back on bursts
+    await _webhook_queue.put((x_github_event, payload, WebhookRepository(repo_id, repo_full_name)))
+    response.status_code = status.HTTP_202_ACCEPTED
+    return {"status": "accepted", "event": x_github_event}
+
+
+@router.post("/github/batch", status_code=status.HTTP_202_ACCEPTED)
+async def handle_github_webhook_batch(batch: WebhookBatch):
+    """
+    Handle several coalesced GitHub webhook deliveries in one request.
+    Each delivery is verified on its own and queued like a single
+    delivery; the result list matches the order of the deliveries.
+    Deliveries are verified one after another so a batch never holds more
+    than one pooled connection. A batch with any missing or malformed
+    signature is rejected whole, before any database lookup.
+    """
+    if any(parse_signature_header(d.signature) is None for d in batch.deliveries):
+        raise _invalid_signature()
+    
+    results = [await _accept_delivery(d) for d in batch.deliveries]
+    return {"status": "accepted", "results": results}
+
+
+async def _accept_delivery(delivery: WebhookDelivery) -> Dict[str, Any]:
+    """Verify and queue one delivery from a batch, reporting its outcome."""
+    body = delivery.payload.encode()
+    try:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return {"status": "rejected", "reason": "Invalid JSON payload"}
+    
+    if not isinstance(payload, dict):
+        return {"status": "rejected", "reason": "Payload is not a JSON object"}
+    repository = payload.get("repository")
+    repo_full_name = repository.get("full_name") if isinstance(repository, dict) else None
+    if not isinstance(repo_full_name, str) or not repo_full_name:
+        return {"status": "ignored", "reason": "No repository in payload"}
+    
+    try:
+        repo_id = await _verify_repository_signature(
+            body, parse_signature_header(delivery.signature), repo_full_name
+        )
+    except HTTPException as e:
+        return {"status": "rejected", "reason": e.detail}
+    if repo_id is None:
+        return {"status": "ignored", "reason": "Repository not tracked"}
+    
+    if delivery.event not in SUPPORTED_EVENTS:
+        return {"status": "ignored", "reason": f"Unhandled event: {delivery.event}"}
+    
+    if delivery.delivery and not await claim_webhook_delivery(delivery.delivery):
+        return {"status": "duplicate"}
+    
+    await _webhook_queue.put((delivery.event, payload, WebhookRepository(repo_id, repo_full_name)))
+    return {"status": "accepted", "event": delivery.event}
+
+
+# ============ Background Workers ============
+
+_webhook_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.WEBHOOK_QUEUE_SIZE)
+
+
+def start_webhook_workers(count: int = settings.WEBHOOK_WORKERS) -> List[asyncio.Task]:
+    """Start the tasks that run queued webhook events and flush batched counters."""
+    workers = [asyncio.create_task(_drain_webhook_queue()) for _ in range(count)]
+    workers.append(asyncio.create_task(_flush_repository_updates_periodically()))
+    return workers
+
+
+async def stop_webhook_workers(workers: List[asyncio.Task], timeout: float = 10):
+    """Give queued events a chance to finish, then stop the workers."""
+    try:
+        await asyncio.wait_for(_webhook_queue.join(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Dropping {_webhook_queue.qsize()} queued webhook events at shutdown")
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await flush_repository_updates()
+
+
+async def _drain_webhook_queue():
+    while True:
+        event, payload, repo = await _webhook_queue.get()
+        try:
+            result = await WEBHOOK_HANDLERS[event](payload, repo)
+            logger.info(f"Processed {event} webhook for {repo.full_name}: {result}")
+        except Exception:
+            logger.exception(f"Failed to process {event} webhook for {repo.full_name}")
+        finally:
+            _webhook_queue.task_done()
+
+
+# ============ Batched Repository Updates ============
+
+# Pending open_issues_count changes per repository, and repositories pushed
+# to since the last flush; both are written out together
+_issue_count_deltas: Dict[UUID, int] = defaultdict(int)
+_pushed_repositories: Set[UUID] = set()
+
+
+async def flush_repository_updates():
+    """Apply pending issue count deltas and push timestamps in one transaction."""
+    deltas = [{"repo_id": repo_id, "delta": delta} for repo_id, delta in _issue_count_deltas.items() if delta]
+    pushed = list(_pushed_repositories)
+    _issue_count_deltas.clear()
+    _pushed_repositories.clear()
+    if not deltas and not pushed:
+        return
+    
+    repositories = Repository.__table__
+    try:
+        async with AsyncSessionLocal() as db:
+            if deltas:
+                # Increment in SQL so concurrent writers can't lose each other's updates
+                await db.execute(
+                    update(repositories)
+                    .where(repositories.c.id == bindparam("repo_id"))
+                    .values(open_issues_count=func.greatest(
+                        0, func.coalesce(repositories.c.open_issues_count, 0) + bindparam("delta")
+                    )),
+                    deltas
+                )
+            if pushed:
+                await db.execute(
+                    update(repositories)
+                    .where(repositories.c.id.in_(pushed))
+                    .values(github_updated_at=func.now())
+                )
+            await db.commit()
+    except BaseException:
+        # Keep the pending updates for the next flush, even when cancelled mid-write
+        for row in deltas:
+            _issue_count_deltas[row["repo_id"]] += row["delta"]
+        _pushed_repositories.update(pushed)
+        raise
+
+
+async def _flush_repository_updates_periodically(interval: float = 0.5):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_repository_updates()
+        except Exception:
+            logger.exception("Failed to flush batched repository updates")
+
+
+# ============ Signature Helpers ============
+
+# repo full_name -> (repository id, active webhook secrets as bytes, monotonic load time)
+_webhook_cache: TTLCache = TTLCache(maxsize=4096, ttl=60)
+
+# Signature mismatches reload a repository's secrets at most this often (seconds)
+WEBHOOK_SECRET_RELOAD_GRACE = 5
+
+# repo full_names with no tracked repository, so repeats skip the database
+_untracked_repositories: TTLCache = TTLCache(maxsize=4096, ttl=30)
+
+# GitHub hook id -> (repository id, repo full_name, secret as bytes)
+_hook_cache: TTLCache = TTLCache(maxsize=4096, ttl=60)
+
+
+async def _read_body_with_hmac(request: Request, secret: bytes) -> Tuple[bytearray, bytes]:
+    """Read the request body and compute its HMAC-SHA256 in the same pass."""
+    mac = keyed_webhook_hmac(secret).copy()
+    body = bytearray()
+    async for chunk in request.stream():
+        mac.update(chunk)
+        body.extend(chunk)
+    return body, mac.digest()
+
+
+async def _verify_repository_signature(
+    body: bytes,
+    expected_signature: Optional[bytes],
+    repo_full_name: str
+) -> Optional[UUID]:
+    """
+    Check a delivery's signature against the repository's active webhook
+    secrets and return the repository id, or None if it isn't tracked.
+    Raises 401 for a bad signature or a repository with no secrets.
+    Tries cached secrets first and reloads from the database on a miss, or
+    on a mismatch in case the repository's webhook secrets just changed,
+    unless they were loaded within the last few seconds. Untracked names
+    are remembered briefly too, so forged deliveries can't make every
+    request a database query.
+    """
+    if expected_signature is None:
+        raise _invalid_signature()
+    
+    cached = _webhook_cache.get(repo_full_name)
+    if cached is not None:
+        if _signature_matches(body, expected_signature, cached[1]):
+            return cached[0]
+        if time.monotonic() - cached[2] < WEBHOOK_SECRET_RELOAD_GRACE:
+            _reject_signature(repo_full_name, cached[1])
+    elif repo_full_name in _untracked_repositories:
+        return None
+    
+    async with AsyncSessionLocal() as db:
+        loaded = await _load_webhook_secrets(db, repo_full_name)
+    if loaded is None:
+        _untracked_repositories[repo_full_name] = True
+        return None
+    
+    repo_id, secrets = loaded
+    _webhook_cache[repo_full_name] = (repo_id, secrets, time.monotonic())
+    if not _signature_matches(body, expected_signature, secrets):
+        _reject_signature(repo_full_name, secrets)
+    return repo_id
+
+
+def _reject_signature(repo_full_name: str, secrets: List[bytes]):
+    """
+    Raise 401 for a delivery that matched none of the secrets. The webhook
+    routes skip JWT auth, so a delivery is only trusted when it is signed
+    with one of the repository's secrets; repositories without an active
+    webhook reject every delivery.
+    """
+    if not secrets:
+        logger.warning(f"Webhook for {repo_full_name}, which has no active webhook secret")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="No webhook secret configured"
+        )
+    logger.warning(f"Invalid webhook signature for {repo_full_name}")
+    raise _invalid_signature()
+
+
+def _invalid_signature() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid webhook signature"
+    )
+
+
+async def _load_webhook_secrets(db: AsyncSession, repo_full_name: str) -> Optional[Tuple[UUID, List[bytes]]]:
+    """
+    Load a repository's id and active webhook secrets in one query, and
+    index each secret by its GitHub hook id for streamed verification.
+    Returns None when the repository isn't tracked.
+    """
+    rows = (await db.execute(
+        select(Repository.id, Webhook.secret, Webhook.github_hook_id)
+        .outerjoin(Webhook, and_(Webhook.repository_id == Repository.id, Webhook.is_active == True))
+        .where(Repository.full_name == repo_full_name)
+    )).all()
+    if not rows:
+        return None
+    
+    repo_id = rows[0].id
+    secrets = []
+    for row in rows:
+        if not row.secret:
+            continue
+        secret = row.secret.encode()
+        secrets.append(secret)
+        if row.github_hook_id is not None:
+            _hook_cache[str(row.github_hook_id)] = (repo_id, repo_full_name, secret)
+    return repo_id, secrets
+
+
+def _signature_matches(body: bytes, expected_signature: Optional[bytes], secrets: List[bytes]) -> bool:
+    """True when the decoded signature header matches one of the secrets."""
+    return expected_signature is not None and match_webhook_signature(body, expected_signature, secrets)
 
 
 # ============ Event Handlers ============
 
-async def handle_push_event(payload: Dict[str, Any], repo: Repository, db) -> Dict[str, Any]:
+class WebhookRepository(NamedTuple):
+    """
+    The repository fields event handlers use, carried over from signature
+    verification so handlers don't load the ORM row. Their writes are
+    batched by id in the periodic flush.
+    """
+    id: UUID
+    full_name: str
+
+
+async def handle_push_event(payload: Dict[str, Any], repo: WebhookRepository) -> Dict[str, Any]:
     """Handle push events."""
     ref = payload.get("ref", "")
     commits = payload.get("commits", [])
@@ -96,10 +400,8 @@ async def handle_push_event(payload: Dict[str, Any], repo: Repository, db) -> Di
     
     logger.info(f"Push to {repo.full_name}: {len(commits)} commits by {pusher}")
     
-    # Update repository last synced
-    from datetime import datetime
-    repo.github_updated_at = datetime.utcnow()
-    db.commit()
+    # Bump github_updated_at to the database's now() on the next flush
+    _pushed_repositories.add(repo.id)
     
     return {
         "branch": ref.replace("refs/heads/", ""),
@@ -108,7 +410,7 @@ async def handle_push_event(payload: Dict[str, Any], repo: Repository, db) -> Di
     }
 
 
-async def handle_pull_request_event(payload: Dict[str, Any], repo: Repository, db) -> Dict[str, Any]:
+async def handle_pull_request_event(payload: Dict[str, Any], repo: WebhookRepository) -> Dict[str, Any]:
     """Handle pull request events."""
     action = payload.get("action")
     pr = payload.get("pull_request", {})
@@ -128,7 +430,7 @@ async def handle_pull_request_event(payload: Dict[str, Any], repo: Repository, d
     }
 
 
-async def handle_issues_event(payload: Dict[str, Any], repo: Repository, db) -> Dict[str, Any]:
+async def handle_issues_event(payload: Dict[str, Any], repo: WebhookRepository) -> Dict[str, Any]:
     """Handle issue events."""
     action = payload.get("action")
     issue = payload.get("issue", {})
@@ -138,12 +440,11 @@ async def handle_issues_event(payload: Dict[str, Any], repo: Repository, db) ->
     
     logger.info(f"Issue {action} on {repo.full_name}: #{issue_number} by {issue_user}")
     
-    # Update open issues count
+    # Update open issues count; batched and written by the periodic flush
     if action == "opened":
-        repo.open_issues_count = (repo.open_issues_count or 0) + 1
+        _issue_count_deltas[repo.id] += 1
     elif action == "closed":
-        repo.open_issues_count = max(0, (repo.open_issues_count or 1) - 1)
-    db.commit()
+        _issue_count_deltas[repo.id] -= 1
     
     return {
         "action": action,
@@ -153,7 +454,7 @@ async def handle_issues_event(payload: Dict[str, Any], repo: Repository, db) ->
     }
 
 
-async def handle_issue_comment_event(payload: Dict[str, Any], repo: Repository, db) -> Dict[str, Any]:
+async def handle_issue_comment_event(payload: Dict[str, Any], repo: WebhookRepository) -> Dict[str, Any]:
     """Handle issue comment events."""
     action = payload.get("action")
     comment = payload.get("comment", {})
@@ -168,7 +469,7 @@ async def handle_issue_comment_event(payload: Dict[str, Any], repo: Repository,
     }
 
 
-async def handle_discussion_event(payload: Dict[str, Any], repo: Repository, db) -> Dict[str, Any]:
+async def handle_discussion_event(payload: Dict[str, Any], repo: WebhookRepository) -> Dict[str, Any]:
     """Handle discussion events."""
     action = payload.get("action")
     discussion = payload.get("discussion", {})
@@ -182,7 +483,7 @@ async def handle_discussion_event(payload: Dict[str, Any], repo: Repository, db)
     }
 
 
-async def handle_create_event(payload: Dict[str, Any], repo: Repository, db) -> Dict[str, Any]:
+async def handle_create_event(payload: Dict[str, Any], repo: WebhookRepository) -> Dict[str, Any]:
     """Handle create events (branch, tag)."""
     ref_type = payload.get("ref_type")
     ref = payload.get("ref")
@@ -195,7 +496,7 @@ async def handle_create_event(payload: Dict[str, Any], repo: Repository, db) ->
     }
 
 
-async def handle_delete_event(payload: Dict[str, Any], repo: Repository, db) -> Dict[str, Any]:
+async def handle_delete_event(payload: Dict[str, Any], repo: WebhookRepository) -> Dict[str, Any]:
     """Handle delete events (branch, tag)."""
     ref_type = payload.get("ref_type")
     ref = payload.get("ref")
@@ -218,3 +519,6 @@ WEBHOOK_HANDLERS = {
     "create": handle_create_event,
     "delete": handle_delete_event,
 }
+
+# Checked in the request path before an event is queued
+SUPPORTED_EVENTS = frozenset(WEBHOOK_HANDLERS)
@@ -1,18 +1,39 @@
 from fastapi import Request, HTTPException, status
 from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
-from datetime import datetime, timedelta
-from typing import Dict, Tuple
-from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, Optional, Tuple
+from collections import defaultdict, deque
+from cachetools import TTLCache
+import hashlib
 import time
 import logging
 
-from app.core.security import verify_token
+from app.core.cache import increment_rate_counter
+from app.core.config import settings
+from app.core.security import TokenPayload, verify_token
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Verified access-token payloads, keyed by a 16-byte token digest. The short
+# TTL caps how long a frontend's repeated requests skip signature checks.
+_verified_tokens: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+
+
+def verify_token_cached(token: str) -> Optional[TokenPayload]:
+    """verify_token, served from the in-process cache until the token expires."""
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    payload = _verified_tokens.get(key)
+    if payload and payload.exp and payload.exp > datetime.now(timezone.utc):
+        return payload
+    
+    payload = verify_token(token)
+    if payload:
+        _verified_tokens[key] = payload
+    return payload
+
 
 class JWTAuthMiddleware(BaseHTTPMiddleware):
     """
@@ -21,21 +42,24 @@ class JWTAuthMiddleware(BaseHTTPMiddleware):
     """
     
     # Routes that don't require authentication
-    PUBLIC_PATHS = {
+    PUBLIC_PATHS = frozenset({
         "/",
-        "/docs",
-        "/redoc",
-        "/openapi.json",
+        "/health",
         "/api/auth/signup",
         "/api/auth/login",
         "/api/auth/github",
         "/api/auth/github/callback",
         "/api/auth/refresh",
-    }
+    })
+    
+    # Route trees that don't require authentication: API docs and their assets,
+    # and GitHub webhook deliveries, which are authenticated by their HMAC signature
+    PUBLIC_PREFIXES = ("/docs", "/redoc", f"{settings.API_V1_STR}/openapi.json", "/api/webhooks/")
     
     async def dispatch(self, request: Request, call_next):
         # Skip auth for public paths
-        if request.url.path in self.PUBLIC_PATHS:
+        path = request.url.path
+        if path in self.PUBLIC_PATHS or path.startswith(self.PUBLIC_PREFIXES):
             return await call_next(request)
         
         # Skip auth for OPTIONS requests (CORS preflight)
@@ -57,8 +81,15 @@ class JWTAuthMiddleware(BaseHTTPMiddleware):
                 content={"detail": "Invalid authentication scheme"}
             )
         
-        token = auth_header.split(" ")[1]
-        payload = verify_token(token)
+        # Slice past "Bearer " rather than splitting; a well-formed token has no whitespace
+        token = auth_header[7:].strip()
+        if not token or " " in token:
+            return JSONResponse(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                content={"detail": "Invalid or expired token"}
+            )
+        
+        payload = verify_token_cached(token)
         
         if not payload:
             return JSONResponse(
@@ -75,12 +106,18 @@ class JWTAuthMiddleware(BaseHTTPMiddleware):
 class RateLimitMiddleware(BaseHTTPMiddleware):
     """
     Rate limiting middleware per IP address and user.
+    Webhook deliveries are exempt: GitHub sends them from a few shared IPs,
+    and each one is authenticated by its HMAC signature instead.
     """
     
+    EXEMPT_PREFIXES = ("/api/webhooks/",)
+    
     def __init__(self, app, requests_per_minute: int = 60):
         super().__init__(app)
         self.requests_per_minute = requests_per_minute
-        self.request_counts: Dict[str, list] = defaultdict(list)
+        # In-process sliding window, used only while Redis is unreachable
+        self.request_counts: Dict[str, Deque[float]] = defaultdict(deque)
+        self._last_prune = 0.0
     
     def _get_client_key(self, request: Request) -> str:
         """Get unique key for rate limiting (IP + user if authenticated)."""
@@ -91,30 +128,42 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
             return f"user:{user_id}"
         return f"ip:{client_ip}"
     
-    def _clean_old_requests(self, key: str, current_time: float):
-        """Remove requests older than 1 minute."""
+    def _count_locally(self, key: str, current_time: float) -> int:
+        """Record a request in the local window and return the client's count."""
         cutoff = current_time - 60
-        self.request_counts[key] = [
-            ts for ts in self.request_counts[key] if ts > cutoff
-        ]
+        
+        # Drop idle clients once a minute so the dict doesn't grow with every IP seen
+        if current_time - self._last_prune >= 60:
+            idle = [k for k, timestamps in self.request_counts.items() if not timestamps or timestamps[-1] <= cutoff]
+            for k in idle:
+                del self.request_counts[k]
+            self._last_prune = current_time
+        
+        # Timestamps are appended in order, so expired ones are always at the left
+        timestamps = self.request_counts[key]
+        while timestamps and timestamps[0] <= cutoff:
+            timestamps.popleft()
+        timestamps.append(current_time)
+        return len(timestamps)
     
     async def dispatch(self, request: Request, call_next):
-        current_time = time.time()
+        if request.url.path.startswith(self.EXEMPT_PREFIXES):
+            return await call_next(request)
+        
         client_key = self._get_client_key(request)
         
-        # Clean old requests
-        self._clean_old_requests(client_key, current_time)
+        # Shared per-minute counter in Redis, falling back to this worker's own window
+        request_count = await increment_rate_counter(client_key)
+        if request_count is None:
+            request_count = self._count_locally(client_key, time.monotonic())
         
         # Check rate limit
-        if len(self.request_counts[client_key]) >= self.requests_per_minute:
+        if request_count > self.requests_per_minute:
             return JSONResponse(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 content={"detail": "Too many requests. Please try again later."}
             )
         
-        # Record request
-        self.request_counts[client_key].append(current_time)
-        
         return await call_next(request)
 
 
@@ -125,25 +174,25 @@ class RequestLoggingMiddleware(BaseHTTPMiddleware):
     """
     
     async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
+        start_time = time.perf_counter_ns()
         
-        # Log request
+        # Log request; arguments are only formatted if INFO is enabled
         logger.info(
-            f"Request: {request.method} {request.url.path} "
-            f"from {request.client.host if request.client else 'unknown'}"
+            "Request: %s %s from %s",
+            request.method, request.url.path,
+            request.client.host if request.client else "unknown"
         )
         
         response = await call_next(request)
         
         # Log response
-        process_time = time.time() - start_time
+        process_time = f"{(time.perf_counter_ns() - start_time) / 1e9:.3f}"
         logger.info(
-            f"Response: {request.method} {request.url.path} "
-            f"status={response.status_code} "
-            f"duration={process_time:.3f}s"
+            "Response: %s %s status=%s duration=%ss",
+            request.method, request.url.path, response.status_code, process_time
         )
         
         # Add processing time header
-        response.headers["X-Process-Time"] = str(process_time)
+        response.headers["X-Process-Time"] = process_time
         
         return response
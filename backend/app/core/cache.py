@@ -0,0 +1,200 @@
+"""
+Redis cache helpers.
+Caches verified access-token sessions so hot authenticated paths can skip
+JWT verification and the user lookup, and short-lived serialized
+repository responses. Also holds the shared rate-limit counters and the
+webhook delivery ids used to reject replays.
+"""
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, Tuple
+import hashlib
+import json
+import logging
+import time
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.security import ACCESS_TOKEN_EXPIRE_MINUTES
+
+logger = logging.getLogger(__name__)
+
+# Short timeouts so an unreachable Redis fails over to the callers'
+# fallbacks quickly instead of blocking on the OS TCP timeout
+redis = Redis.from_url(
+    settings.REDIS_URL,
+    decode_responses=True,
+    socket_connect_timeout=settings.REDIS_TIMEOUT,
+    socket_timeout=settings.REDIS_TIMEOUT,
+    health_check_interval=30
+)
+
+
+def _token_digest(token: str) -> str:
+    """Hash tokens so raw JWTs are never stored as Redis keys."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _remaining_seconds(expires_at: Optional[datetime]) -> int:
+    if not expires_at:
+        return 0
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return int((expires_at - datetime.now(timezone.utc)).total_seconds())
+
+
+async def get_cached_session(token: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Look up a cached session for an access token.
+    Returns (user_data, revoked). On a miss or when Redis is unavailable,
+    user_data is None and the caller falls back to verifying the token.
+    """
+    digest = _token_digest(token)
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.get(f"sess:{digest}")
+            pipe.exists(f"revoked:{digest}")
+            cached, revoked = await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Session cache lookup failed: {e}")
+        return None, False
+
+    if revoked:
+        return None, True
+    return (json.loads(cached) if cached else None), False
+
+
+def _sessions_index_key(user_id: str) -> str:
+    return f"sess:{user_id}:keys"
+
+
+async def cache_session(token: str, user_data: Dict[str, Any], expires_at: Optional[datetime]):
+    """
+    Cache user data for a token until the token itself expires. The key is
+    also recorded in a per-user index set so profile writes can drop every
+    cached session for the user at once.
+    """
+    ttl = _remaining_seconds(expires_at)
+    if ttl <= 0:
+        return
+    key = f"sess:{_token_digest(token)}"
+    index_key = _sessions_index_key(user_data["id"])
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.set(key, json.dumps(user_data), ex=ttl)
+            pipe.sadd(index_key, key)
+            # No cached session outlives a fresh access token
+            pipe.expire(index_key, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+            await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Session cache write failed: {e}")
+
+
+async def invalidate_user_sessions(user_id: str):
+    """Drop every cached session for a user; the tokens themselves stay valid."""
+    index_key = _sessions_index_key(user_id)
+    try:
+        keys = await redis.smembers(index_key)
+        await redis.delete(index_key, *keys)
+    except RedisError as e:
+        logger.warning(f"Session cache invalidation failed: {e}")
+
+
+async def revoke_session(token: str, expires_at: Optional[datetime]):
+    """
+    Drop the cached session and leave a revocation marker for the rest of
+    the token's lifetime, so the token can't be re-cached after logout.
+    """
+    digest = _token_digest(token)
+    ttl = _remaining_seconds(expires_at)
+    try:
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.delete(f"sess:{digest}")
+            if ttl > 0:
+                pipe.set(f"revoked:{digest}", "1", ex=ttl)
+            await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Session revocation failed: {e}")
+
+
+# ============ Repository response cache ============
+
+REPOSITORY_CACHE_TTL = 30  # seconds
+
+
+def _repositories_index_key(user_id: str) -> str:
+    return f"repos:{user_id}:keys"
+
+
+async def get_cached_repositories(user_id: str, variant: str) -> Optional[str]:
+    """Return a cached, already-serialized repository response for a user."""
+    try:
+        return await redis.get(f"repos:{user_id}:{variant}")
+    except RedisError as e:
+        logger.warning(f"Repository cache lookup failed: {e}")
+        return None
+
+
+async def cache_repositories(user_id: str, variant: str, payload: bytes):
+    """
+    Cache a serialized repository response. Each key is also recorded in a
+    per-user index set so writes can invalidate every variant at once.
+    """
+    key = f"repos:{user_id}:{variant}"
+    index_key = _repositories_index_key(user_id)
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.set(key, payload, ex=REPOSITORY_CACHE_TTL)
+            pipe.sadd(index_key, key)
+            pipe.expire(index_key, REPOSITORY_CACHE_TTL)
+            await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Repository cache write failed: {e}")
+
+
+async def invalidate_repositories(user_id: str):
+    """Drop every cached repository response for a user."""
+    index_key = _repositories_index_key(user_id)
+    try:
+        keys = await redis.smembers(index_key)
+        await redis.delete(index_key, *keys)
+    except RedisError as e:
+        logger.warning(f"Repository cache invalidation failed: {e}")
+
+
+# ============ Rate limiting ============
+
+async def increment_rate_counter(client_key: str, window_seconds: int = 60) -> Optional[int]:
+    """
+    Count a request against the client's current fixed window and return
+    the running total. Counters are shared by every worker. Returns None
+    when Redis is unavailable.
+    """
+    window = int(time.time() // window_seconds)
+    key = f"rl:{client_key}:{window}"
+    try:
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.incr(key)
+            # Outlive the window slightly so a late request can't reset the count
+            pipe.expire(key, window_seconds + 10)
+            count, _ = await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Rate limit counter failed: {e}")
+        return None
+    return count
+
+
+# ============ Webhook replay protection ============
+
+async def claim_webhook_delivery(delivery_id: str, ttl: int = settings.WEBHOOK_REPLAY_TTL) -> bool:
+    """
+    Record a GitHub delivery id with an atomic set-if-absent. Returns False
+    when the id was already seen within the last `ttl` seconds. When Redis
+    is unavailable the delivery is allowed through.
+    """
+    try:
+        return bool(await redis.set(f"gh:{delivery_id}", "1", nx=True, ex=ttl))
+    except RedisError as e:
+        logger.warning(f"Webhook delivery claim failed: {e}")
+        return True
@@ -28,6 +28,22 @@ class Settings(BaseSettings):
     GITHUB_CLIENT_SECRET: str = ""
     GITHUB_REDIRECT_URI: str = "http://localhost:8000/api/auth/github/callback"
 
+    # Redis
+    REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_TIMEOUT: float = 0.5  # seconds, for both connecting and each command
+
+    # Database connection pool
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_STATEMENT_CACHE_SIZE: int = 500  # asyncpg prepared statements per connection
+
+    # Background webhook processing
+    WEBHOOK_WORKERS: int = 4
+    WEBHOOK_QUEUE_SIZE: int = 1000
+    WEBHOOK_REPLAY_TTL: int = 600  # seconds a delivery id is remembered
+
     class Config:
         case_sensitive = True
         env_file = ".env"
@@ -0,0 +1,23 @@
+"""
+Logging setup.
+Moves the root logger's handlers onto a background listener thread so
+code on the event loop only enqueues records instead of writing to stderr.
+"""
+from logging.handlers import QueueHandler, QueueListener
+import logging
+import queue
+
+
+def start_queue_logging() -> QueueListener:
+    """
+    Route root logging through a queue and start the listener that drains it.
+    Call stop() on the returned listener at shutdown to flush pending records.
+    """
+    root = logging.getLogger()
+    handlers = root.handlers or [logging.StreamHandler()]
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    return listener
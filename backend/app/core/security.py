@@ -1,11 +1,20 @@
 from datetime import datetime, timedelta
-from typing import Optional, Any
+from typing import Optional, Any, Tuple
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Argon2id with OWASP-recommended parameters; bcrypt kept so existing
+# hashes still verify and get upgraded on the next successful login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__time_cost=2,
+    argon2__memory_cost=46 * 1024,  # KiB
+    argon2__parallelism=1
+)
 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
@@ -51,5 +60,12 @@ def verify_token(token: str, token_type: str = "access") -> Optional[TokenPayloa
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password and return a replacement hash when the stored one
+    uses a deprecated scheme or outdated parameters.
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
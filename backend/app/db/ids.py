@@ -0,0 +1,20 @@
+"""
+Primary key generation.
+UUIDv7 keys lead with a millisecond timestamp, so new rows land at the end
+of the primary key index instead of at random pages like uuid4.
+"""
+import os
+import time
+import uuid
+
+
+def _uuid7() -> uuid.UUID:
+    """RFC 9562 UUIDv7: 48-bit Unix ms timestamp followed by 74 random bits."""
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), "big")
+    value = (value & ~(0xF << 76)) | (0x7 << 76)  # version
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)  # variant
+    return uuid.UUID(int=value)
+
+
+# Python 3.14+ ships uuid.uuid7
+uuid7 = getattr(uuid, "uuid7", _uuid7)
@@ -2,8 +2,8 @@ from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
-import uuid
 
+from app.db.ids import uuid7
 from app.db.session import Base
 
 
@@ -15,7 +15,7 @@ class User(Base):
     __tablename__ = "users"
     __table_args__ = {"schema": "auth"}
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     email = Column(String, unique=True, index=True, nullable=False)
     encrypted_password = Column(String, nullable=True)
     email_confirmed_at = Column(DateTime(timezone=True), nullable=True)
@@ -23,7 +23,8 @@ class User(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     # Relationships
-    profile = relationship("UserProfile", back_populates="user", uselist=False)
+    # lazy="raise" so a missing eager load fails loudly instead of issuing a hidden query
+    profile = relationship("UserProfile", back_populates="user", uselist=False, lazy="raise")
     api_keys = relationship("APIKey", back_populates="user")
     sessions = relationship("Session", back_populates="user")
 
@@ -35,7 +36,7 @@ class UserProfile(Base):
     """
     __tablename__ = "user_profiles"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     user_id = Column(UUID(as_uuid=True), ForeignKey("auth.users.id", ondelete="CASCADE"), unique=True, nullable=False)
     
     # GitHub OAuth data
@@ -65,7 +66,7 @@ class APIKey(Base):
     """
     __tablename__ = "api_keys"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     user_id = Column(UUID(as_uuid=True), ForeignKey("auth.users.id", ondelete="CASCADE"), nullable=False)
     
     name = Column(String, nullable=False)
@@ -93,7 +94,7 @@ class Session(Base):
     """
     __tablename__ = "user_sessions"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     user_id = Column(UUID(as_uuid=True), ForeignKey("auth.users.id", ondelete="CASCADE"), nullable=False)
     
     # Session info
@@ -1,10 +1,10 @@
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Text, Integer, Enum
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Text, Integer, Enum, Index, text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
-import uuid
 import enum
 
+from app.db.ids import uuid7
 from app.db.session import Base
 
 
@@ -37,8 +37,22 @@ class Repository(Base):
     GitHub repository data and configuration.
     """
     __tablename__ = "repositories"
-
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    __table_args__ = (
+        # Serves list_repositories' default filter and its keyset
+        # ORDER BY updated_at DESC, id DESC, ties included
+        Index(
+            "idx_repositories_owner_active_updated",
+            "owner_id",
+            text("updated_at DESC"),
+            text("id DESC"),
+            postgresql_where=text("is_active")
+        ),
+    )
+    # Fetch server defaults (last_synced_at, created_at, ...) via RETURNING
+    # so handlers can serialize a new or synced row without a refresh
+    __mapper_args__ = {"eager_defaults": True}
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     
     # GitHub data
     github_id = Column(Integer, unique=True, nullable=False, index=True)
@@ -66,19 +80,25 @@ class Repository(Base):
     
     # Sync status
     is_active = Column(Boolean, default=True)
-    last_synced_at = Column(DateTime(timezone=True), nullable=True)
+    # Stamped by the database on insert and on each sync; not onupdate, since
+    # webhook counter updates are not syncs
+    last_synced_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=True)
     sync_error = Column(Text, nullable=True)
+    # ETag of the last synced GitHub response, for conditional syncs
+    etag = Column(String(255), nullable=True)
     
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     github_created_at = Column(DateTime(timezone=True), nullable=True)
     github_updated_at = Column(DateTime(timezone=True), nullable=True)
     
     # Relationships
-    members = relationship("RepositoryMember", back_populates="repository", cascade="all, delete-orphan")
-    webhooks = relationship("Webhook", back_populates="repository", cascade="all, delete-orphan")
-    settings = relationship("RepositorySettings", back_populates="repository", uselist=False, cascade="all, delete-orphan")
+    # passive_deletes lets the ON DELETE CASCADE foreign keys remove children,
+    # so deleting a repository never lazy-loads these collections
+    members = relationship("RepositoryMember", back_populates="repository", cascade="all, delete-orphan", passive_deletes=True)
+    webhooks = relationship("Webhook", back_populates="repository", cascade="all, delete-orphan", passive_deletes=True)
+    settings = relationship("RepositorySettings", back_populates="repository", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
 
 
 class RepositoryMember(Base):
@@ -87,7 +107,7 @@ class RepositoryMember(Base):
     """
     __tablename__ = "repository_members"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     
     repository_id = Column(UUID(as_uuid=True), ForeignKey("repositories.id", ondelete="CASCADE"), nullable=False)
     user_id = Column(UUID(as_uuid=True), ForeignKey("auth.users.id", ondelete="CASCADE"), nullable=False)
@@ -113,8 +133,16 @@ class Webhook(Base):
     GitHub webhook configuration for a repository.
     """
     __tablename__ = "webhooks"
+    __table_args__ = (
+        # Serves the webhook handler's active-secret lookup for a repository
+        Index(
+            "idx_webhooks_repository_active",
+            "repository_id",
+            postgresql_where=text("is_active")
+        ),
+    )
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     
     repository_id = Column(UUID(as_uuid=True), ForeignKey("repositories.id", ondelete="CASCADE"), nullable=False)
     
@@ -147,7 +175,7 @@ class RepositorySettings(Base):
     """
     __tablename__ = "repository_settings"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     
     repository_id = Column(UUID(as_uuid=True), ForeignKey("repositories.id", ondelete="CASCADE"), unique=True, nullable=False)
     
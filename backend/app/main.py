@@ -1,14 +1,28 @@
-from fastapi import FastAPI
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import math
+import multiprocessing
+
+import httpx
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from app.core.config import settings
 from app.api.endpoints.auth import router as auth_router
 from app.api.endpoints.repositories import router as repositories_router
-from app.api.endpoints.webhooks import router as webhooks_router
+from app.api.endpoints.webhooks import router as webhooks_router, start_webhook_workers, stop_webhook_workers
 from app.api.middleware import JWTAuthMiddleware, RateLimitMiddleware, RequestLoggingMiddleware
+from app.core.cache import redis
+from app.core.logs import start_queue_logging
+from app.db.session import async_engine, warmup_pool
+from app.services.github import GitHubRateLimited, close_github_client
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    default_response_class=ORJSONResponse
 )
 
 # Set all CORS enabled origins
@@ -31,6 +45,46 @@ app.include_router(auth_router)
 app.include_router(repositories_router)
 app.include_router(webhooks_router)
 
+@app.exception_handler(GitHubRateLimited)
+async def github_rate_limited(request: Request, exc: GitHubRateLimited):
+    # Tell the client when to retry instead of holding the request open
+    return ORJSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "GitHub rate limit exceeded, try again later"},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
+@app.on_event("startup")
+async def startup():
+    # Log writes happen on a listener thread, off the event loop
+    app.state.log_listener = start_queue_logging()
+    # Shared pooled client so outbound GitHub calls reuse keep-alive connections
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+        timeout=10
+    )
+    # Password hashing is CPU-bound; keep it off the event loop. Workers are
+    # spawned, not forked, so they don't inherit the log listener thread's
+    # locks or the open HTTP, database and Redis sockets
+    app.state.hash_pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+    # Webhook deliveries are acknowledged first and handled by these workers
+    app.state.webhook_workers = start_webhook_workers()
+    try:
+        await warmup_pool()
+    except Exception as e:
+        logger.warning(f"Database pool warmup failed: {e}")
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_webhook_workers(app.state.webhook_workers)
+    await app.state.http.aclose()
+    await close_github_client()
+    app.state.hash_pool.shutdown()
+    await async_engine.dispose()
+    await redis.aclose()
+    app.state.log_listener.stop()
+
 @app.get("/")
 def root():
     return {"message": "Welcome to Echov3 API"}
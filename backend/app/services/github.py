@@ -2,13 +2,19 @@
 GitHub API Service
 Handles all interactions with GitHub API for repository management.
 """
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterable, Tuple
 from datetime import datetime
+from cachetools import TTLCache
+import asyncio
+import ciso8601
+import functools
 import httpx
+import orjson
 import hmac
 import hashlib
 import secrets
 import logging
+import time
 
 from app.core.config import settings
 
@@ -16,29 +22,177 @@ logger = logging.getLogger(__name__)
 
 GITHUB_API_URL = "https://api.github.com"
 
+# One pooled HTTP/2 client shared by every GitHubService, so calls reuse
+# keep-alive connections to api.github.com instead of a handshake each
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_github_client() -> httpx.AsyncClient:
+    """Return the shared GitHub API client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=GITHUB_API_URL,
+            headers={
+                "Accept": "application/vnd.github+json",
+                "X-GitHub-Api-Version": "2022-11-28"
+            },
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+            http2=True,
+            timeout=10
+        )
+    return _client
+
+
+# (access token, path) -> (ETag, decoded body) for conditional GETs; outlives
+# the 15 minute sync interval so each cycle can revalidate
+_etag_cache: TTLCache = TTLCache(maxsize=4096, ttl=3600)
+
+
+def _decode(response: httpx.Response) -> Any:
+    """Decode a JSON response body with orjson instead of the stdlib parser."""
+    return orjson.loads(response.content)
+
+
+async def close_github_client():
+    """Close the shared GitHub API client at shutdown."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+# Webhook HMACs should run in OpenSSL, which uses the CPU's SHA extensions when present
+if type(hashlib.sha256()).__module__ != "_hashlib":
+    logger.warning("hashlib.sha256 is not OpenSSL-backed; webhook signature checks will be slow")
+
+
+# Longest a request-path call waits for its rate limit slot before failing
+INTERACTIVE_RATE_LIMIT_WAIT = 1.0
+
+
+class GitHubRateLimited(Exception):
+    """A GitHub call would have had to wait too long for its rate limit."""
+    
+    def __init__(self, retry_after: float):
+        super().__init__(f"GitHub rate limit exceeded; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class RateLimitPacer:
+    """
+    Paces one token's requests using the X-RateLimit headers GitHub sends
+    on every response. Requests go straight out while plenty of the budget
+    is left; once it runs low they are spaced evenly over the time left
+    until the reset, and an exhausted budget waits for the reset itself.
+    """
+    
+    RESERVE = 100
+    
+    def __init__(self):
+        self.remaining: Optional[int] = None
+        self.reset: float = 0
+        self._next_slot: float = 0
+    
+    def update(self, headers: httpx.Headers):
+        remaining = headers.get("x-ratelimit-remaining")
+        reset = headers.get("x-ratelimit-reset")
+        if remaining is not None and reset is not None:
+            self.remaining = int(remaining)
+            self.reset = float(reset)
+    
+    async def acquire(self, max_wait: Optional[float] = None):
+        """
+        Wait for this token's next request slot. Raises GitHubRateLimited
+        instead when the wait would be longer than `max_wait` seconds.
+        """
+        if self.remaining is None or self.remaining > self.RESERVE:
+            return
+        now = time.time()
+        if now >= self.reset:
+            return
+        if self.remaining == 0:
+            slot, spacing = max(self.reset, self._next_slot), 0
+        else:
+            slot, spacing = max(now, self._next_slot), (self.reset - now) / self.remaining
+        wait = slot - now
+        if max_wait is not None and wait > max_wait:
+            raise GitHubRateLimited(wait)
+        if spacing:
+            self._next_slot = slot + spacing
+        if wait > 0:
+            logger.warning("GitHub rate limit low (%s left); waiting %.1fs", self.remaining, wait)
+            await asyncio.sleep(wait)
+
+
+# access token -> its pacer; GitHub's rate limit window is an hour
+_rate_limits: TTLCache = TTLCache(maxsize=4096, ttl=3600)
+
 
 class GitHubService:
     """
     Service for interacting with GitHub API.
     """
     
-    def __init__(self, access_token: str):
+    def __init__(self, access_token: str, max_rate_limit_wait: Optional[float] = INTERACTIVE_RATE_LIMIT_WAIT):
+        """
+        Calls made while handling a request fail fast with GitHubRateLimited
+        rather than wait out a low rate limit; background tasks pass
+        max_rate_limit_wait=None to be paced for as long as it takes.
+        """
         self.access_token = access_token
-        self.headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Accept": "application/vnd.github+json",
-            "X-GitHub-Api-Version": "2022-11-28"
-        }
+        self.max_rate_limit_wait = max_rate_limit_wait
+        # Only the per-user header; the rest are set on the shared client
+        self.headers = {"Authorization": f"Bearer {access_token}"}
+        self.rate_limit = _rate_limits.get(access_token)
+        if self.rate_limit is None:
+            self.rate_limit = _rate_limits[access_token] = RateLimitPacer()
+    
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs: Any
+    ) -> httpx.Response:
+        """
+        Send a request on the shared client as this user, paced by and
+        recording the token's GitHub rate limit.
+        """
+        await self.rate_limit.acquire(self.max_rate_limit_wait)
+        response = await get_github_client().request(
+            method,
+            path,
+            headers=self.headers if headers is None else {**self.headers, **headers},
+            **kwargs
+        )
+        self.rate_limit.update(response.headers)
+        return response
+    
+    async def _get_conditional(self, path: str) -> Any:
+        """
+        GET a resource, revalidating a cached copy with If-None-Match.
+        GitHub answers an unchanged resource with an empty 304, which
+        doesn't count against the rate limit and needs no decoding.
+        """
+        key = (self.access_token, path)
+        cached = _etag_cache.get(key)
+        headers = None if cached is None else {"If-None-Match": cached[0]}
+        response = await self._request("GET", path, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            return cached[1]
+        response.raise_for_status()
+        data = _decode(response)
+        etag = response.headers.get("etag")
+        if etag:
+            _etag_cache[key] = (etag, data)
+        return data
     
     async def get_user(self) -> Dict[str, Any]:
         """Get authenticated user info."""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{GITHUB_API_URL}/user",
-                headers=self.headers
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self._request("GET", "/user")
+        response.raise_for_status()
+        return _decode(response)
     
     async def list_repositories(
         self, 
@@ -58,54 +212,47 @@ class GitHubService:
         if visibility:
             params["visibility"] = visibility
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{GITHUB_API_URL}/user/repos",
-                headers=self.headers,
-                params=params
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self._request(
+            "GET",
+            "/user/repos",
+            params=params
+        )
+        response.raise_for_status()
+        return _decode(response)
     
     async def get_repository(self, owner: str, repo: str) -> Dict[str, Any]:
         """Get a specific repository."""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{GITHUB_API_URL}/repos/{owner}/{repo}",
-                headers=self.headers
-            )
-            response.raise_for_status()
-            return response.json()
+        return await self._get_conditional(f"/repos/{owner}/{repo}")
+    
+    async def get_repository_if_changed(
+        self,
+        owner: str,
+        repo: str,
+        etag: Optional[str]
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Get a repository unless it still matches a stored ETag. Returns
+        (None, etag) when GitHub answers 304, else the repository and its
+        new ETag.
+        """
+        headers = {"If-None-Match": etag} if etag else None
+        response = await self._request("GET", f"/repos/{owner}/{repo}", headers=headers)
+        if response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+        return _decode(response), response.headers.get("etag")
     
     async def list_branches(self, owner: str, repo: str) -> List[Dict[str, Any]]:
         """List branches for a repository."""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{GITHUB_API_URL}/repos/{owner}/{repo}/branches",
-                headers=self.headers
-            )
-            response.raise_for_status()
-            return response.json()
+        return await self._get_conditional(f"/repos/{owner}/{repo}/branches")
     
     async def list_contributors(self, owner: str, repo: str) -> List[Dict[str, Any]]:
         """List contributors for a repository."""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{GITHUB_API_URL}/repos/{owner}/{repo}/contributors",
-                headers=self.headers
-            )
-            response.raise_for_status()
-            return response.json()
+        return await self._get_conditional(f"/repos/{owner}/{repo}/contributors")
     
     async def get_repository_languages(self, owner: str, repo: str) -> Dict[str, int]:
         """Get languages used in a repository."""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{GITHUB_API_URL}/repos/{owner}/{repo}/languages",
-                headers=self.headers
-            )
-            response.raise_for_status()
-            return response.json()
+        return await self._get_conditional(f"/repos/{owner}/{repo}/languages")
     
     async def create_webhook(
         self, 
@@ -118,43 +265,32 @@ class GitHubService:
         """
         Create a webhook for a repository.
         """
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{GITHUB_API_URL}/repos/{owner}/{repo}/hooks",
-                headers=self.headers,
-                json={
-                    "name": "web",
-                    "active": True,
-                    "events": events,
-                    "config": {
-                        "url": webhook_url,
-                        "content_type": "json",
-                        "secret": secret,
-                        "insecure_ssl": "0"
-                    }
+        response = await self._request(
+            "POST",
+            f"/repos/{owner}/{repo}/hooks",
+            json={
+                "name": "web",
+                "active": True,
+                "events": events,
+                "config": {
+                    "url": webhook_url,
+                    "content_type": "json",
+                    "secret": secret,
+                    "insecure_ssl": "0"
                 }
-            )
-            response.raise_for_status()
-            return response.json()
+            }
+        )
+        response.raise_for_status()
+        return _decode(response)
     
     async def delete_webhook(self, owner: str, repo: str, hook_id: int) -> bool:
         """Delete a webhook from a repository."""
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(
-                f"{GITHUB_API_URL}/repos/{owner}/{repo}/hooks/{hook_id}",
-                headers=self.headers
-            )
-            return response.status_code == 204
+        response = await self._request("DELETE", f"/repos/{owner}/{repo}/hooks/{hook_id}")
+        return response.status_code == 204
     
     async def list_webhooks(self, owner: str, repo: str) -> List[Dict[str, Any]]:
         """List webhooks for a repository."""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{GITHUB_API_URL}/repos/{owner}/{repo}/hooks",
-                headers=self.headers
-            )
-            response.raise_for_status()
-            return response.json()
+        return await self._get_conditional(f"/repos/{owner}/{repo}/hooks")
     
     async def check_repository_permissions(self, owner: str, repo: str) -> Dict[str, bool]:
         """Check user permissions for a repository."""
@@ -171,39 +307,51 @@ class GitHubService:
     
     async def get_open_issues_count(self, owner: str, repo: str) -> int:
         """Get count of open issues."""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{GITHUB_API_URL}/repos/{owner}/{repo}/issues",
-                headers=self.headers,
-                params={"state": "open", "per_page": 1}
-            )
-            response.raise_for_status()
-            # Get total from link header if available
-            link_header = response.headers.get("link", "")
-            if 'rel="last"' in link_header:
-                # Parse last page number
-                import re
-                match = re.search(r'page=(\d+)>; rel="last"', link_header)
-                if match:
-                    return int(match.group(1))
-            return len(response.json())
+        response = await self._request(
+            "GET",
+            f"/repos/{owner}/{repo}/issues",
+            params={"state": "open", "per_page": 1}
+        )
+        response.raise_for_status()
+        # With per_page=1 the last page number is the total
+        last_page = _parse_last_page(response.headers.get("link", ""))
+        if last_page is not None:
+            return last_page
+        # Without a last link there is at most one item; no need to decode it
+        return 1 if response.content.strip()[1:-1].strip() else 0
     
     async def get_open_prs_count(self, owner: str, repo: str) -> int:
         """Get count of open pull requests."""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{GITHUB_API_URL}/repos/{owner}/{repo}/pulls",
-                headers=self.headers,
-                params={"state": "open", "per_page": 1}
-            )
-            response.raise_for_status()
-            link_header = response.headers.get("link", "")
-            if 'rel="last"' in link_header:
-                import re
-                match = re.search(r'page=(\d+)>; rel="last"', link_header)
-                if match:
-                    return int(match.group(1))
-            return len(response.json())
+        response = await self._request(
+            "GET",
+            f"/repos/{owner}/{repo}/pulls",
+            params={"state": "open", "per_page": 1}
+        )
+        response.raise_for_status()
+        # With per_page=1 the last page number is the total
+        last_page = _parse_last_page(response.headers.get("link", ""))
+        if last_page is not None:
+            return last_page
+        # Without a last link there is at most one item; no need to decode it
+        return 1 if response.content.strip()[1:-1].strip() else 0
+
+
+def _parse_last_page(link_header: str) -> Optional[int]:
+    """
+    Read the page number of the rel="last" link from a Link header, e.g.
+    '<https://api.github.com/...&page=42>; rel="last"'. Returns None when
+    there is no last link.
+    """
+    end = link_header.find('>; rel="last"')
+    if end == -1:
+        return None
+    start = link_header.rfind("page=", 0, end)
+    if start == -1:
+        return None
+    try:
+        return int(link_header[start + 5:end])
+    except ValueError:
+        return None
 
 
 def generate_webhook_secret() -> str:
@@ -211,20 +359,49 @@ def generate_webhook_secret() -> str:
     return secrets.token_hex(32)
 
 
+def parse_signature_header(signature: Optional[str]) -> Optional[bytes]:
+    """
+    Decode an X-Hub-Signature-256 header ("sha256=<64 hex chars>") into the
+    raw 32-byte digest. Returns None for a missing or malformed header.
+    """
+    if not signature or len(signature) != 71 or not signature.startswith("sha256="):
+        return None
+    try:
+        return bytes.fromhex(signature[7:])
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=1024)
+def keyed_webhook_hmac(secret: bytes) -> hmac.HMAC:
+    """
+    An HMAC-SHA256 already keyed with a webhook secret. Callers copy() it,
+    which clones the padded key state instead of re-deriving it from the
+    secret on every delivery.
+    """
+    return hmac.new(secret, digestmod=hashlib.sha256)
+
+
+def match_webhook_signature(payload: bytes, expected: bytes, secrets: Iterable[bytes]) -> bool:
+    """
+    Check a decoded signature against each candidate secret (as bytes),
+    stopping at the first match. Digests are compared as raw bytes in
+    constant time.
+    """
+    for secret in secrets:
+        mac = keyed_webhook_hmac(secret).copy()
+        mac.update(payload)
+        if hmac.compare_digest(mac.digest(), expected):
+            return True
+    return False
+
+
 def verify_webhook_signature(payload: bytes, signature: str, secret: str) -> bool:
     """
     Verify GitHub webhook signature.
     """
-    if not signature:
-        return False
-    
-    expected_signature = "sha256=" + hmac.new(
-        secret.encode(),
-        payload,
-        hashlib.sha256
-    ).hexdigest()
-    
-    return hmac.compare_digest(signature, expected_signature)
+    expected = parse_signature_header(signature)
+    return expected is not None and match_webhook_signature(payload, expected, (secret.encode(),))
 
 
 def parse_github_datetime(dt_string: Optional[str]) -> Optional[datetime]:
@@ -232,6 +409,7 @@ def parse_github_datetime(dt_string: Optional[str]) -> Optional[datetime]:
     if not dt_string:
         return None
     try:
-        return datetime.fromisoformat(dt_string.replace("Z", "+00:00"))
+        # C parser; handles GitHub's trailing "Z" without a string replace
+        return ciso8601.parse_datetime(dt_string)
     except ValueError:
         return None
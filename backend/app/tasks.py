@@ -1,15 +1,15 @@
 """
 Background tasks for the Echo application.
 """
-from datetime import datetime, timedelta
+from datetime import timedelta
 from typing import Optional
 import asyncio
 import logging
 import httpx
 
-from sqlalchemy.orm import Session
-from app.db.session import SessionLocal
-from app.db.models import UserProfile, UserSession
+from sqlalchemy import delete, func, select, update
+from app.db.session import AsyncSessionLocal
+from app.db.models import UserProfile, Session as UserSession
 
 logger = logging.getLogger(__name__)
 
@@ -30,26 +30,25 @@ async def sync_github_user_data(user_id: str, github_access_token: str):
             )
             
             if response.status_code != 200:
-                logger.error(f"Failed to fetch GitHub user data: {response.status_code}")
+                logger.error("Failed to fetch GitHub user data: %s", response.status_code)
                 return
             
             github_user = response.json()
             
             # Update profile in database
-            db = SessionLocal()
-            try:
-                profile = db.query(UserProfile).filter(UserProfile.user_id == user_id).first()
+            async with AsyncSessionLocal() as db:
+                profile = (await db.execute(
+                    select(UserProfile).where(UserProfile.user_id == user_id)
+                )).scalar_one_or_none()
                 if profile:
                     profile.github_username = github_user.get("login")
                     profile.github_avatar_url = github_user.get("avatar_url")
                     profile.display_name = github_user.get("name") or profile.display_name
-                    db.commit()
-                    logger.info(f"Synced GitHub data for user {user_id}")
-            finally:
-                db.close()
+                    await db.commit()
+                    logger.info("Synced GitHub data for user %s", user_id)
                 
     except Exception as e:
-        logger.error(f"Error syncing GitHub data: {e}")
+        logger.error("Error syncing GitHub data: %s", e)
 
 
 async def cleanup_expired_sessions():
@@ -57,30 +56,40 @@ async def cleanup_expired_sessions():
     Cleanup expired sessions from the database.
     Should be run periodically (e.g., every hour).
     """
-    db = SessionLocal()
-    try:
-        now = datetime.utcnow()
-        
-        # Delete sessions that have expired
-        expired_count = db.query(UserSession).filter(
-            UserSession.expires_at < now
-        ).delete()
-        
-        # Deactivate sessions inactive for more than 7 days
-        inactive_threshold = now - timedelta(days=7)
-        inactive_count = db.query(UserSession).filter(
-            UserSession.last_active_at < inactive_threshold,
-            UserSession.is_active == True
-        ).update({"is_active": False})
-        
-        db.commit()
-        logger.info(f"Cleaned up {expired_count} expired sessions, deactivated {inactive_count} inactive sessions")
-        
-    except Exception as e:
-        logger.error(f"Error cleaning up sessions: {e}")
-        db.rollback()
-    finally:
-        db.close()
+    sessions = UserSession.__table__
+    # Both sweeps run in one statement against the database clock. Expired
+    # rows are left out of the UPDATE so no row is modified twice.
+    expired = (
+        delete(sessions)
+        .where(sessions.c.expires_at < func.now())
+        .returning(sessions.c.id)
+        .cte("expired")
+    )
+    deactivated = (
+        update(sessions)
+        .where(
+            sessions.c.last_active_at < func.now() - timedelta(days=7),
+            sessions.c.is_active == True,
+            sessions.c.expires_at >= func.now()
+        )
+        .values(is_active=False)
+        .returning(sessions.c.id)
+        .cte("deactivated")
+    )
+    
+    async with AsyncSessionLocal() as db:
+        try:
+            expired_count, inactive_count = (await db.execute(select(
+                select(func.count()).select_from(expired).scalar_subquery(),
+                select(func.count()).select_from(deactivated).scalar_subquery()
+            ))).one()
+            
+            await db.commit()
+            logger.info("Cleaned up %s expired sessions, deactivated %s inactive sessions", expired_count, inactive_count)
+            
+        except Exception as e:
+            logger.error("Error cleaning up sessions: %s", e)
+            await db.rollback()
 
 
 async def send_welcome_email(user_email: str, display_name: Optional[str] = None):
@@ -93,7 +102,7 @@ async def send_welcome_email(user_email: str, display_name: Optional[str] = None
         
         # TODO: Replace with actual email sending logic
         # For now, just log the email
-        logger.info(f"Sending welcome email to {user_email}")
+        logger.info("Sending welcome email to %s", user_email)
         
         email_content = f"""
         Hi {name}!
@@ -114,10 +123,10 @@ async def send_welcome_email(user_email: str, display_name: Optional[str] = None
         # In production:
         # await send_email(to=user_email, subject="Welcome to Echo!", body=email_content)
         
-        logger.info(f"Welcome email sent to {user_email}")
+        logger.info("Welcome email sent to %s", user_email)
         
     except Exception as e:
-        logger.error(f"Error sending welcome email: {e}")
+        logger.error("Error sending welcome email: %s", e)
 
 
 class BackgroundTaskRunner:
@@ -146,21 +155,33 @@ class BackgroundTaskRunner:
                 pass
         logger.info("Background task runner stopped")
     
-    async def _run_periodic_tasks(self):
-        """Run periodic tasks in a loop."""
+    async def _run_periodic_tasks(self, interval: float = 3600):
+        """
+        Run periodic tasks in a loop. Runs are scheduled against monotonic
+        deadlines, so the cadence doesn't drift with how long a run takes
+        and isn't moved by wall clock jumps.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
         while self.running:
             try:
                 # Cleanup sessions every hour
                 await cleanup_expired_sessions()
-                
-                # Wait 1 hour before next cleanup
-                await asyncio.sleep(3600)
+                deadline += interval
                 
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                logger.error(f"Error in periodic tasks: {e}")
-                await asyncio.sleep(60)  # Wait a minute before retrying
+                logger.error("Error in periodic tasks: %s", e)
+                deadline = loop.time() + 60  # Wait a minute before retrying
+            
+            # A run that overran its slot starts the next one right away
+            # without trying to catch up on the missed ones
+            deadline = max(deadline, loop.time())
+            try:
+                await asyncio.sleep(deadline - loop.time())
+            except asyncio.CancelledError:
+                break
 
 
 # Global task runner instance
@@ -1,176 +1,294 @@
 """
 Background tasks for repository management.
 """
-from datetime import datetime, timedelta
-from typing import List
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+from uuid import UUID
 import asyncio
 import logging
+import operator
 
-from sqlalchemy.orm import Session
-from app.db.session import SessionLocal
+from sqlalchemy import bindparam, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.session import AsyncSessionLocal
 from app.db.models import UserProfile
 from app.db.models_repo import Repository, RepositorySettings
 from app.services.github import GitHubService, parse_github_datetime
 
 logger = logging.getLogger(__name__)
 
+# Repositories synced at once, within GitHub's secondary rate limits
+SYNC_CONCURRENCY = 16
+
+# Key for picking the primary language out of {language: bytes} items
+_byte_count = operator.itemgetter(1)
+
+
+async def fetch_repository_sync(
+    repo_id: UUID,
+    full_name: str,
+    github_token: str,
+    etag: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Fetch a repository from GitHub and return the column values to write
+    for it, keyed for the bulk updates below. When GitHub reports the
+    repository unchanged since `etag`, only the id is returned, and a
+    failed fetch returns just the sync error.
+    """
+    github = GitHubService(github_token, max_rate_limit_wait=None)
+    parts = full_name.split("/")
+    try:
+        github_repo, etag = await github.get_repository_if_changed(parts[0], parts[1], etag)
+    except Exception as e:
+        logger.error("Failed to sync %s: %s", full_name, e)
+        return {"repo_id": repo_id, "sync_error": str(e)}
+    if github_repo is None:
+        return {"repo_id": repo_id}
+    
+    return {
+        "repo_id": repo_id,
+        "description": github_repo.get("description"),
+        "visibility": github_repo.get("visibility", "public"),
+        "default_branch": github_repo.get("default_branch", "main"),
+        "language": github_repo.get("language"),
+        "stars_count": github_repo.get("stargazers_count", 0),
+        "forks_count": github_repo.get("forks_count", 0),
+        "open_issues_count": github_repo.get("open_issues_count", 0),
+        "watchers_count": github_repo.get("watchers_count", 0),
+        "github_updated_at": parse_github_datetime(github_repo.get("updated_at")),
+        "etag": etag
+    }
+
+
+# Executed with fetch_repository_sync rows; the remaining keys of each row
+# become the SET clause, so many repositories are written per statement
+_repositories = Repository.__table__
+_apply_sync = (
+    update(_repositories)
+    .where(_repositories.c.id == bindparam("repo_id"))
+    .values(last_synced_at=func.now())
+)
+
+
+async def write_repository_syncs(db: AsyncSession, rows: List[Dict[str, Any]]):
+    """
+    Write fetched repository data and sync errors in one transaction.
+    Rows are grouped by their keys, so unchanged repositories only have
+    last_synced_at and sync_error set.
+    """
+    groups = defaultdict(list)
+    failed = []
+    for row in rows:
+        if "sync_error" in row:
+            failed.append(row)
+        else:
+            row = {**row, "sync_error": None}
+            groups[frozenset(row)].append(row)
+    for group in groups.values():
+        await db.execute(_apply_sync, group)
+    if failed:
+        await db.execute(update(_repositories).where(_repositories.c.id == bindparam("repo_id")), failed)
+    await db.commit()
+
 
 async def sync_repository(repo_id: str, github_token: str):
     """
     Sync a single repository from GitHub.
     """
-    db = SessionLocal()
-    try:
-        repo = db.query(Repository).filter(Repository.id == repo_id).first()
+    async with AsyncSessionLocal() as db:
+        repo = await db.get(Repository, repo_id)
         if not repo:
-            logger.warning(f"Repository {repo_id} not found for sync")
+            logger.warning("Repository %s not found for sync", repo_id)
             return
+        repo_id, full_name, etag = repo.id, repo.full_name, repo.etag
+        # End the read so no connection is held across the GitHub call
+        await db.commit()
         
-        github = GitHubService(github_token)
-        parts = repo.full_name.split("/")
-        
-        try:
-            github_repo = await github.get_repository(parts[0], parts[1])
-            
-            # Update repository data
-            repo.description = github_repo.get("description")
-            repo.visibility = github_repo.get("visibility", "public")
-            repo.default_branch = github_repo.get("default_branch", "main")
-            repo.language = github_repo.get("language")
-            repo.stars_count = github_repo.get("stargazers_count", 0)
-            repo.forks_count = github_repo.get("forks_count", 0)
-            repo.open_issues_count = github_repo.get("open_issues_count", 0)
-            repo.watchers_count = github_repo.get("watchers_count", 0)
-            repo.github_updated_at = parse_github_datetime(github_repo.get("updated_at"))
-            repo.last_synced_at = datetime.utcnow()
-            repo.sync_error = None
-            
-            db.commit()
-            logger.info(f"Synced repository: {repo.full_name}")
-            
-        except Exception as e:
-            repo.sync_error = str(e)
-            db.commit()
-            logger.error(f"Failed to sync {repo.full_name}: {e}")
-            
-    finally:
-        db.close()
+        row = await fetch_repository_sync(repo_id, full_name, github_token, etag)
+        await write_repository_syncs(db, [row])
+    if "sync_error" not in row:
+        logger.info("Synced repository: %s", full_name)
 
 
 async def sync_all_repositories():
     """
-    Sync all active repositories that are due for sync.
+    Sync all active repositories that are due for sync. Fetches run
+    concurrently and their results are written back in one transaction.
     """
-    db = SessionLocal()
-    try:
-        # Get repositories that need syncing
-        now = datetime.utcnow()
-        
-        repos_to_sync = db.query(Repository, RepositorySettings, UserProfile).join(
-            RepositorySettings, Repository.id == RepositorySettings.repository_id
-        ).join(
-            UserProfile, Repository.owner_id == UserProfile.user_id
-        ).filter(
-            Repository.is_active == True,
-            RepositorySettings.auto_sync == True
-        ).all()
-        
-        for repo, settings, profile in repos_to_sync:
-            # Check if due for sync
-            if repo.last_synced_at:
-                next_sync = repo.last_synced_at + timedelta(minutes=settings.sync_interval_minutes)
-                if now < next_sync:
-                    continue
-            
-            if profile.github_access_token:
-                await sync_repository(str(repo.id), profile.github_access_token)
-            else:
-                logger.warning(f"No GitHub token for user {profile.user_id}")
-        
-        logger.info(f"Repository sync cycle complete")
-        
-    except Exception as e:
-        logger.error(f"Error in sync_all_repositories: {e}")
-    finally:
-        db.close()
+    async with AsyncSessionLocal() as db:
+        try:
+            # Get repositories that are due for sync; the interval check runs in
+            # Postgres against its own clock, so only due rows come back
+            repos_to_sync = (await db.execute(
+                select(
+                    Repository.id, Repository.full_name, Repository.etag,
+                    UserProfile.user_id, UserProfile.github_access_token
+                )
+                .join(RepositorySettings, Repository.id == RepositorySettings.repository_id)
+                .join(UserProfile, Repository.owner_id == UserProfile.user_id)
+                .where(
+                    Repository.is_active == True,
+                    RepositorySettings.auto_sync == True,
+                    or_(
+                        Repository.last_synced_at.is_(None),
+                        # make_interval(years, months, weeks, days, hours, mins)
+                        Repository.last_synced_at + func.make_interval(
+                            0, 0, 0, 0, 0, RepositorySettings.sync_interval_minutes
+                        ) <= func.now()
+                    )
+                )
+            )).all()
+            # One session serves the whole cycle; ending the read hands its
+            # connection back to the pool for the GitHub fan-out
+            await db.commit()
+            
+            semaphore = asyncio.Semaphore(SYNC_CONCURRENCY)
+            
+            async def fetch_bounded(repo_id: UUID, full_name: str, github_token: str, etag: Optional[str]):
+                async with semaphore:
+                    return await fetch_repository_sync(repo_id, full_name, github_token, etag)
+            
+            fetches = []
+            for repo in repos_to_sync:
+                if repo.github_access_token:
+                    fetches.append(fetch_bounded(repo.id, repo.full_name, repo.github_access_token, repo.etag))
+                else:
+                    logger.warning("No GitHub token for user %s", repo.user_id)
+            
+            # One failed fetch shouldn't cancel the rest of the cycle
+            rows = []
+            for result in await asyncio.gather(*fetches, return_exceptions=True):
+                if isinstance(result, Exception):
+                    logger.error("Repository sync failed: %s", result)
+                else:
+                    rows.append(result)
+            
+            if rows:
+                await write_repository_syncs(db, rows)
+            logger.info("Repository sync cycle complete: %s repositories", len(rows))
+            
+        except Exception as e:
+            logger.error("Error in sync_all_repositories: %s", e)
 
 
 async def analyze_repository_codebase(repo_id: str, github_token: str):
     """
     Analyze repository codebase structure.
     """
-    db = SessionLocal()
-    try:
-        repo = db.query(Repository).filter(Repository.id == repo_id).first()
-        if not repo:
-            return
-        
-        github = GitHubService(github_token)
-        parts = repo.full_name.split("/")
-        
-        # Get languages
-        languages = await github.get_repository_languages(parts[0], parts[1])
-        if languages:
-            # Set primary language (highest byte count)
-            primary_lang = max(languages, key=languages.get) if languages else None
-            if primary_lang:
-                repo.language = primary_lang
-                db.commit()
-        
-        logger.info(f"Analyzed codebase for {repo.full_name}")
-        
-    except Exception as e:
-        logger.error(f"Error analyzing codebase: {e}")
-    finally:
-        db.close()
+    async with AsyncSessionLocal() as db:
+        try:
+            repo = await db.get(Repository, repo_id)
+            if not repo:
+                return
+            # End the read so no connection is held across the GitHub call
+            await db.commit()
+            
+            github = GitHubService(github_token, max_rate_limit_wait=None)
+            parts = repo.full_name.split("/")
+            
+            # Get languages
+            languages = await github.get_repository_languages(parts[0], parts[1])
+            if languages:
+                # Set primary language (highest byte count)
+                primary_lang = max(languages.items(), key=_byte_count)[0] if languages else None
+                if primary_lang:
+                    repo.language = primary_lang
+                    await db.commit()
+            
+            logger.info("Analyzed codebase for %s", repo.full_name)
+            
+        except Exception as e:
+            logger.error("Error analyzing codebase: %s", e)
 
 
 async def discover_branches(repo_id: str, github_token: str):
     """
     Discover and cache branches for a repository.
     """
-    db = SessionLocal()
-    try:
-        repo = db.query(Repository).filter(Repository.id == repo_id).first()
-        if not repo:
-            return
-        
-        github = GitHubService(github_token)
-        parts = repo.full_name.split("/")
-        
-        branches = await github.list_branches(parts[0], parts[1])
-        # TODO: Store branches in database if needed
-        
-        logger.info(f"Discovered {len(branches)} branches for {repo.full_name}")
-        
-    except Exception as e:
-        logger.error(f"Error discovering branches: {e}")
-    finally:
-        db.close()
+    async with AsyncSessionLocal() as db:
+        try:
+            repo = await db.get(Repository, repo_id)
+            if not repo:
+                return
+            # End the read so no connection is held across the GitHub call
+            await db.commit()
+            
+            github = GitHubService(github_token, max_rate_limit_wait=None)
+            parts = repo.full_name.split("/")
+            
+            branches = await github.list_branches(parts[0], parts[1])
+            # TODO: Store branches in database if needed
+            
+            logger.info("Discovered %s branches for %s", len(branches), repo.full_name)
+            
+        except Exception as e:
+            logger.error("Error discovering branches: %s", e)
 
 
 async def analyze_contributors(repo_id: str, github_token: str):
     """
     Analyze contributors for a repository.
     """
-    db = SessionLocal()
-    try:
-        repo = db.query(Repository).filter(Repository.id == repo_id).first()
+    async with AsyncSessionLocal() as db:
+        try:
+            repo = await db.get(Repository, repo_id)
+            if not repo:
+                return
+            # End the read so no connection is held across the GitHub call
+            await db.commit()
+            
+            github = GitHubService(github_token, max_rate_limit_wait=None)
+            parts = repo.full_name.split("/")
+            
+            contributors = await github.list_contributors(parts[0], parts[1])
+            # TODO: Store contributors in database if needed
+            
+            logger.info("Analyzed %s contributors for %s", len(contributors), repo.full_name)
+            
+        except Exception as e:
+            logger.error("Error analyzing contributors: %s", e)
+
+
+async def refresh_repository(repo_id: str, github_token: str):
+    """
+    Sync a repository and analyze its languages, branches and contributors
+    in one pass. The four GitHub reads don't depend on each other, so they
+    run concurrently over the shared client, and the results are written
+    in a single transaction.
+    """
+    async with AsyncSessionLocal() as db:
+        repo = await db.get(Repository, repo_id)
         if not repo:
+            logger.warning("Repository %s not found for refresh", repo_id)
             return
+        repo_id, full_name, etag = repo.id, repo.full_name, repo.etag
+        # End the read so no connection is held across the GitHub calls
+        await db.commit()
         
-        github = GitHubService(github_token)
-        parts = repo.full_name.split("/")
+        github = GitHubService(github_token, max_rate_limit_wait=None)
+        owner, name = full_name.split("/")
+        row, languages, branches, contributors = await asyncio.gather(
+            fetch_repository_sync(repo_id, full_name, github_token, etag),
+            github.get_repository_languages(owner, name),
+            github.list_branches(owner, name),
+            github.list_contributors(owner, name),
+            return_exceptions=True
+        )
         
-        contributors = await github.list_contributors(parts[0], parts[1])
-        # TODO: Store contributors in database if needed
+        # Primary language by byte count, preferred over GitHub's own pick
+        if "sync_error" not in row and languages and not isinstance(languages, Exception):
+            row["language"] = max(languages.items(), key=_byte_count)[0]
+        await write_repository_syncs(db, [row])
         
-        logger.info(f"Analyzed {len(contributors)} contributors for {repo.full_name}")
-        
-    except Exception as e:
-        logger.error(f"Error analyzing contributors: {e}")
-    finally:
-        db.close()
+        for kind, result in (("branches", branches), ("contributors", contributors)):
+            if isinstance(result, Exception):
+                logger.error("Error fetching %s for %s: %s", kind, full_name, result)
+            else:
+                logger.info("Found %s %s for %s", len(result), kind, full_name)
+        if isinstance(languages, Exception):
+            logger.error("Error analyzing codebase for %s: %s", full_name, languages)
+        logger.info("Refreshed repository: %s", full_name)
 
 
 class RepositorySyncRunner:
@@ -199,18 +317,28 @@ class RepositorySyncRunner:
                 pass
         logger.info("Repository sync runner stopped")
     
-    async def _run_periodic_sync(self):
-        """Run periodic sync in a loop."""
+    async def _run_periodic_sync(self, interval: float = 900):
+        """
+        Run periodic sync in a loop, every 15 minutes by default, against
+        monotonic deadlines so the cadence doesn't drift with sync time.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
         while self.running:
             try:
                 await sync_all_repositories()
-                # Run every 15 minutes
-                await asyncio.sleep(900)
+                deadline += interval
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                logger.error(f"Error in periodic sync: {e}")
-                await asyncio.sleep(60)
+                logger.error("Error in periodic sync: %s", e)
+                deadline = loop.time() + 60
+            
+            deadline = max(deadline, loop.time())
+            try:
+                await asyncio.sleep(deadline - loop.time())
+            except asyncio.CancelledError:
+                break
 
 
 # Global sync runner instance
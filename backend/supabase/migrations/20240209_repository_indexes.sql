@@ -0,0 +1,11 @@
+-- Repository Query Indexes Migration for Echov3
+-- Indexes tailored to the hot API filters on repositories
+
+-- list_repositories: WHERE owner_id = ? AND is_active ORDER BY updated_at DESC
+-- Partial index matches the default is_active filter and serves the ORDER BY
+-- directly, so the listing stays an index scan as the table grows.
+-- (Plain CREATE INDEX: CONCURRENTLY can't run inside the migration transaction.)
+CREATE INDEX IF NOT EXISTS idx_repositories_owner_active_updated
+    ON public.repositories(owner_id, updated_at DESC)
+    WHERE is_active;
+
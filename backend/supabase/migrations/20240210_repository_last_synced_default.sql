@@ -0,0 +1,5 @@
+-- Repository Sync Timestamp Migration for Echov3
+-- Let the database stamp last_synced_at when a repository is added
+
+ALTER TABLE public.repositories
+    ALTER COLUMN last_synced_at SET DEFAULT NOW();
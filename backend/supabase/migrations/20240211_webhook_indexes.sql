@@ -0,0 +1,12 @@
+-- Webhook Query Indexes Migration for Echov3
+-- Indexes tailored to the webhook delivery hot path
+
+-- Webhook handler: WHERE repository_id = ? AND is_active
+-- Partial index only holds active hooks, so it stays small as hooks are disabled.
+CREATE INDEX IF NOT EXISTS idx_webhooks_repository_active
+    ON public.webhooks(repository_id)
+    WHERE is_active;
+
+-- full_name is UNIQUE, and that constraint's btree index already serves the
+-- handler's full_name lookup; this second index only added write cost.
+DROP INDEX IF EXISTS public.idx_repositories_full_name;
@@ -0,0 +1,6 @@
+-- Repository ETag Migration for Echov3
+-- Store the ETag of each repository's last sync so unchanged repositories
+-- can be revalidated with a conditional request
+
+ALTER TABLE public.repositories
+    ADD COLUMN IF NOT EXISTS etag VARCHAR(255);
@@ -0,0 +1,8 @@
+-- Repository Keyset Index Migration for Echov3
+-- list_repositories pages on (updated_at, id); add id as the trailing key so
+-- rows that tie on updated_at come out of the index already in cursor order
+
+DROP INDEX IF EXISTS public.idx_repositories_owner_active_updated;
+CREATE INDEX IF NOT EXISTS idx_repositories_owner_active_updated
+    ON public.repositories(owner_id, updated_at DESC, id DESC)
+    WHERE is_active;
@@ -97,8 +97,15 @@ function RepositoriesContent() {
 
     const loadRepositories = async () => {
         try {
-            const data = await repositoriesApi.list();
-            setRepos(data);
+            let page = await repositoriesApi.list();
+            let loaded = page.items;
+            setRepos(loaded);
+            setLoading(false);
+            while (page.next_cursor) {
+                page = await repositoriesApi.list(false, page.next_cursor);
+                loaded = [...loaded, ...page.items];
+                setRepos(loaded);
+            }
         } catch (err) {
             setError(err instanceof Error ? err.message : 'Failed to load repositories');
         } finally {
@@ -1,4 +1,4 @@
-import { Repository, RepositorySettings, Branch, Webhook } from '@/lib/types/repository';
+import { Repository, RepositoryPage, RepositorySettings, Branch, Webhook } from '@/lib/types/repository';
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
@@ -25,8 +25,10 @@ async function fetchWithAuth(url: string, options: RequestInit = {}) {
 }
 
 export const repositoriesApi = {
-    async list(includeInactive = false): Promise<Repository[]> {
-        return fetchWithAuth(`${API_BASE_URL}/api/repositories?include_inactive=${includeInactive}`);
+    async list(includeInactive = false, cursor?: string): Promise<RepositoryPage> {
+        const params = new URLSearchParams({ include_inactive: String(includeInactive) });
+        if (cursor) params.set('cursor', cursor);
+        return fetchWithAuth(`${API_BASE_URL}/api/repositories?${params}`);
     },
 
     async add(fullName: string): Promise<Repository> {
@@ -17,6 +17,11 @@ export interface Repository {
     last_synced_at?: string;
 }
 
+export interface RepositoryPage {
+    items: Repository[];
+    next_cursor?: string | null;
+}
+
 export interface RepositorySettings {
     auto_sync?: boolean;
     sync_interval_minutes?: number;